@@ -3,9 +3,84 @@ from __future__ import unicode_literals
 
 from django.contrib import admin
 from . import models
-# Register your models here.
-admin.site.register(models.Bug)
-admin.site.register(models.Product)
-admin.site.register(models.Component)
-admin.site.register(models.Severity)
-admin.site.register(models.Status)
+from .pagination import EstimatedCountPaginator
+
+
+class LookupAdmin(admin.ModelAdmin):
+    list_display = ('name', )
+    search_fields = ('name', )
+    ordering = ('name', )
+
+
+@admin.register(models.Component)
+class ComponentAdmin(LookupAdmin):
+    list_display = ('name', 'product')
+    search_fields = ('name', 'product')
+    ordering = ('product', 'name')
+
+
+@admin.register(models.Bug)
+class BugAdmin(admin.ModelAdmin):
+    list_display = ('bz_id', 'summary', 'product', 'component', 'status', 'severity', 'is_open', 'last_change_time')
+    list_select_related = ('product', 'component', 'status', 'severity')
+    # FK columns are indexed, and these tables small enough to list their choices
+    list_filter = ('is_open', 'status', 'severity', 'priority', 'product')
+    # Handled by `get_search_results`, the field only turns the search box on
+    search_fields = ('summary', )
+    ordering = ('-bz_id', )
+    # Users and components are too many for select boxes
+    raw_id_fields = ('assigned_to', 'creator', 'qa_contact', 'cc', 'component')
+    paginator = EstimatedCountPaginator
+    # No COUNT(*) of the whole table next to the filtered count
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        A bug id, or words searched in the bugs' text (see `BugQuerySet.search`), rather
+        than the default `UPPER(summary) LIKE` scanning every bug.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(bz_id=int(search_term)), False
+        return queryset.search(search_term), False
+
+
+@admin.register(models.Comment)
+class CommentAdmin(admin.ModelAdmin):
+    list_display = ('bz_id', 'bug', 'count', 'creator', 'creation_time')
+    list_select_related = ('bug', 'creator')
+    raw_id_fields = ('bug', 'creator')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(models.BugHistoryEntry)
+class BugHistoryEntryAdmin(admin.ModelAdmin):
+    list_display = ('bug', 'when', 'who', 'field_name', 'removed', 'added')
+    list_select_related = ('bug', 'who')
+    raw_id_fields = ('bug', 'who')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+for model in (models.Classification, models.Flag, models.Group, models.Keyword,
+              models.OpSys, models.Platform, models.Priority, models.Product, models.Severity,
+              models.Status, models.TargetMilestone):
+    admin.site.register(model, LookupAdmin)
+admin.site.register(models.ImportCheckpoint)
+admin.site.register(models.ImportRun)
+
+
+@admin.register(models.BugCount)
+class BugCountAdmin(admin.ModelAdmin):
+    list_display = ('product', 'component', 'severity', 'status', 'is_open', 'count')
+    list_select_related = ('product', 'component', 'severity', 'status')
+    list_filter = ('is_open', 'status', 'severity', 'product')
+
+
+@admin.register(models.BugCountSnapshot)
+class BugCountSnapshotAdmin(BugCountAdmin):
+    list_display = ('date', ) + BugCountAdmin.list_display
+    date_hierarchy = 'date'
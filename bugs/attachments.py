@@ -0,0 +1,87 @@
+"""
+Ingestion of bug attachments: metadata for many bugs per Bugzilla request,
+content streamed to storage one attachment at a time.
+"""
+import tempfile
+
+from django.core.files import File
+
+from bugs import models
+from bugs.lookups import insert_ignoring_conflicts
+from bugs.third_party.bugzilla import BugzillaAPIError
+from bugs.utils import chunked
+
+
+class AttachmentImporter(object):
+    """
+    Saves the attachments of saved bugs.
+
+    Metadata is fetched for `BATCH_SIZE` bugs per request and without the content.
+    The content of attachments not downloaded yet is then streamed, base64 decoded
+    on the fly, to a temporary file and from there to the `data` file storage,
+    so worker memory stays flat whatever the size of the attachment.
+    """
+    BATCH_SIZE = 100
+    METADATA_FIELDS = ('creation_time', 'last_change_time', 'file_name', 'summary', 'content_type',
+                       'size', 'is_patch', 'is_obsolete', 'is_private')
+
+    def __init__(self, bz):
+        self.bz = bz
+        self.saved_count = 0
+        self.downloaded_count = 0
+
+    def _save_metadata(self, pk_by_bz_id, attachments):
+        user_pks = self.bz.users.resolve({'email': attachment['creator']} for attachment in attachments)
+        saved = dict(models.Attachment.objects.filter(
+            bz_id__in=[attachment['id'] for attachment in attachments]
+        ).values_list('bz_id', 'last_change_time'))
+        new_attachments = []
+        for attachment in attachments:
+            obj = models.Attachment(
+                bz_id=attachment['id'],
+                bug_id=pk_by_bz_id[attachment['bug_id']],
+                creator_id=user_pks[attachment['creator']],
+                **{field: attachment[field] for field in self.METADATA_FIELDS}
+            )
+            if attachment['id'] not in saved:
+                new_attachments.append(obj)
+            elif saved[attachment['id']] != models.Attachment._meta.get_field(
+                    'last_change_time').to_python(attachment['last_change_time']):
+                # Only flags like is_obsolete can change, the content of an attachment can't
+                models.Attachment.objects.filter(bz_id=attachment['id']).update(
+                    **{field: getattr(obj, field) for field in self.METADATA_FIELDS})
+        insert_ignoring_conflicts(models.Attachment, new_attachments)
+        self.saved_count += len(attachments)
+
+    def download(self, attachment):
+        """
+        Stream the content of given saved Attachment into its `data` file.
+        """
+        with tempfile.TemporaryFile() as tmp:
+            success, size_or_error = self.bz.download_attachment(attachment.bz_id, tmp)
+            if not success:
+                raise BugzillaAPIError("Attachment %d download failure" % attachment.bz_id, size_or_error)
+            tmp.seek(0)
+            attachment.data.save('%d/%s' % (attachment.bz_id, attachment.file_name), File(tmp))
+        self.downloaded_count += 1
+
+    def save_attachments(self, bz_ids, download=True):
+        """
+        Fetch and save the attachments of the given saved bugs, and download the content
+        of the ones not downloaded yet if `download`. Returns the number of attachments saved.
+        """
+        for chunk in chunked(bz_ids, self.BATCH_SIZE):
+            pk_by_bz_id = dict(models.Bug.objects.filter(bz_id__in=chunk).values_list('bz_id', 'pk'))
+            if not pk_by_bz_id:
+                continue
+            success, attachments_or_error = self.bz.fetch_attachments(list(pk_by_bz_id))
+            if not success:
+                raise BugzillaAPIError("Attachment fetch failure", attachments_or_error)
+            self._save_metadata(pk_by_bz_id, [
+                attachment for bug_attachments in attachments_or_error.values()
+                for attachment in bug_attachments
+            ])
+            if download:
+                for attachment in models.Attachment.objects.filter(bug_id__in=pk_by_bz_id.values(), data=''):
+                    self.download(attachment)
+        return self.saved_count
@@ -0,0 +1,356 @@
+"""
+Import benchmark: synthetic bugs shaped like the Bugzilla bugs API's, served by
+`bugzilla_stub.StubBugzillaServer`, fetched and saved by `BugzillaAPI`
+while measuring throughput, queries and memory. See the `benchmark_import` command.
+
+Index benchmark: the query plans and timings of the importer's and reports' queries,
+with and without the indexes meant for them. See the `benchmark_indexes` command.
+"""
+import datetime
+import json
+import random
+import resource
+import threading
+import time
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+
+from bugs import models
+from bugs.third_party.bugzilla import BugzillaAPI
+from bugs.third_party.bugzilla_stub import StubBugzillaServer
+from bugs.third_party.throttle import HostThrottle
+
+
+class BugGenerator(object):
+    """
+    Generates bug dicts as returned in `bugs` by Bugzilla bugs API, deterministic for a given `seed`.
+
+    `cc_size` is the average number of users CC'd per bug, `keywords`/`flags` the number
+    of distinct keywords/flags (each bug gets up to 3 of each), and `link_density` the average
+    number of blocks/depends_on/see_also references per bug, to bugs of the same set.
+    """
+    PRODUCTS = 20
+    COMPONENTS_PER_PRODUCT = 15
+    USERS = 2000
+    STATUSES = ('UNCONFIRMED', 'NEW', 'ASSIGNED', 'REOPENED', 'NEEDINFO', 'RESOLVED', 'VERIFIED', 'CLOSED')
+    SEVERITIES = ('blocker', 'critical', 'major', 'normal', 'minor', 'trivial', 'enhancement')
+    PRIORITIES = ('P1', 'P2', 'P3', 'P4', 'P5')
+    OP_SYS = ('All', 'Linux', 'Windows', 'Mac OS X', 'Solaris')
+    PLATFORMS = ('All', 'PC', 'Macintosh', 'Other')
+
+    def __init__(self, first_id=1, cc_size=3, keywords=30, flags=10, link_density=0.5, seed=0):
+        self.first_id = first_id
+        self.cc_size = cc_size
+        self.keywords = keywords
+        self.flags = flags
+        self.link_density = link_density
+        self.random = random.Random(seed)
+
+    def _user(self):
+        n = self.random.randint(1, self.USERS)
+        return {'email': 'user%d@example.com' % n, 'real_name': 'User %d' % n, 'name': 'user%d' % n, 'id': n}
+
+    def _time(self, start, end):
+        seconds = self.random.randint(0, int((end - start).total_seconds()))
+        return (start + datetime.timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _references(self, bz_id, count, last_id):
+        return sorted(set(self.random.randint(self.first_id, last_id) for _ in range(count)) - {bz_id})
+
+    def _sample(self, prefix, cardinality, maximum=3):
+        if not cardinality:
+            return []
+        names = set('%s%d' % (prefix, self.random.randint(1, cardinality))
+                    for _ in range(self.random.randint(0, maximum)))
+        return sorted(names)
+
+    def generate_bug(self, bz_id, last_id):
+        product = self.random.randint(1, self.PRODUCTS)
+        assigned_to, creator = self._user(), self._user()
+        cc = [self._user() for _ in range(int(self.random.expovariate(1.0 / self.cc_size)) if self.cc_size else 0)]
+        links = int(self.random.expovariate(1.0 / self.link_density)) if self.link_density else 0
+        status = self.random.choice(self.STATUSES)
+        see_also = int(self.random.random() < self.link_density / 4)
+        creation_time = self._time(datetime.datetime(2000, 1, 1), datetime.datetime(2019, 1, 1))
+        return {
+            'id': bz_id,
+            'alias': [],
+            'assigned_to': assigned_to['email'],
+            'assigned_to_detail': assigned_to,
+            'blocks': self._references(bz_id, links // 2, last_id),
+            'cc': [user['email'] for user in cc],
+            'cc_detail': cc,
+            'classification': 'Unclassified',
+            'component': 'Component %d.%d' % (product, self.random.randint(1, self.COMPONENTS_PER_PRODUCT)),
+            'creation_time': creation_time,
+            'creator': creator['email'],
+            'creator_detail': creator,
+            'deadline': None,
+            'depends_on': self._references(bz_id, links - links // 2, last_id),
+            'dupe_of': None,
+            'flags': [{'name': name, 'status': '?', 'setter': creator['email']}
+                      for name in self._sample('flag', self.flags)],
+            'groups': [],
+            'is_cc_accessible': True,
+            'is_confirmed': status != 'UNCONFIRMED',
+            'is_creator_accessible': True,
+            'is_open': status not in ('RESOLVED', 'VERIFIED', 'CLOSED'),
+            'keywords': self._sample('keyword', self.keywords),
+            'last_change_time': self._time(datetime.datetime.strptime(creation_time, '%Y-%m-%dT%H:%M:%SZ'),
+                                           datetime.datetime(2019, 6, 1)),
+            'op_sys': self.random.choice(self.OP_SYS),
+            'platform': self.random.choice(self.PLATFORMS),
+            'priority': self.random.choice(self.PRIORITIES),
+            'product': 'Product %d' % product,
+            'qa_contact': '',
+            'resolution': '' if status not in ('RESOLVED', 'VERIFIED', 'CLOSED') else 'FIXED',
+            'see_also': ['https://bz.example.com/show_bug.cgi?id=%d' % ref
+                         for ref in self._references(bz_id, see_also, last_id)],
+            'severity': self.random.choice(self.SEVERITIES),
+            'status': status,
+            'summary': 'Synthetic bug %d %s' % (bz_id, 'x' * self.random.randint(10, 120)),
+            'target_milestone': '---',
+            'url': '',
+            'version': '%d.%d' % (self.random.randint(1, 9), self.random.randint(0, 9)),
+            'whiteboard': '',
+        }
+
+    def generate(self, count):
+        last_id = self.first_id + count - 1
+        return [self.generate_bug(bz_id, last_id) for bz_id in range(self.first_id, last_id + 1)]
+
+
+def get_rss():
+    """
+    Current resident set size of this process in MB, None where /proc isn't available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return
+    return pages * resource.getpagesize() / (1024.0 * 1024.0)
+
+
+class RSSSampler(object):
+    """
+    Samples the RSS of this process every `interval` seconds from a background thread
+    while in use as a context manager. `increase_mb` is then the peak RSS seen above
+    the RSS on entry, in MB: unlike ru_maxrss, which is the peak of the whole process,
+    it tells what one stage needed even after an earlier stage peaked higher.
+    None where the RSS can't be read.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_mb = self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = get_rss()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = get_rss()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+
+    @property
+    def increase_mb(self):
+        if self.start_mb is not None:
+            return self.peak_mb - self.start_mb
+
+
+class ImportBenchmark(object):
+    """
+    Times the import stages against a StubBugzillaServer serving the given bugs.
+    Each `run_*` method returns a result dict (stage, bugs, seconds, bugs_per_sec,
+    queries, queries_per_bug, rss_increase_mb), also collected in `results`.
+
+    The stub host is not rate limited and responses are not cached, so fetch
+    timings measure the client, not the politeness limits or the cache. Saving stages write to the database: run them
+    in a transaction that gets rolled back, as the command does.
+    """
+
+    def __init__(self, bugs, page_size=None, concurrency=None):
+        self.bugs = bugs
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.server = None
+        self.results = []
+
+    def __enter__(self):
+        self.server = StubBugzillaServer(self.bugs).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.stop()
+
+    def get_api(self):
+        bz = BugzillaAPI(url_base=self.server.url_base, concurrency=self.concurrency)
+        # Not the shared throttle of the stub host, which already has the politeness limits
+        bz.throttle = HostThrottle(rate=1e6, burst=bz.concurrency)
+        # Even with BUGZILLA_HTTP_CACHE_PATH set, every page must come from the stub
+        bz.cache = None
+        return bz
+
+    def _measure(self, stage, func, count):
+        with CaptureQueriesContext(connection) as queries, RSSSampler() as rss:
+            start = time.time()
+            value = func()
+            seconds = time.time() - start
+        result = {
+            'stage': stage,
+            'bugs': count,
+            'seconds': seconds,
+            'bugs_per_sec': count / seconds if seconds else 0,
+            'queries': len(queries),
+            'queries_per_bug': len(queries) / float(count) if count else 0,
+            'rss_increase_mb': rss.increase_mb,
+        }
+        self.results.append(result)
+        return value, result
+
+    def run_fetch(self):
+        """
+        Fetch all bugs page by page with `iter_bug_pages` (so `fetch_bugs`), returns them.
+        """
+        bz = self.get_api()
+        fetch = lambda: [bug for page in bz.iter_bug_pages(page_size=self.page_size) for bug in page]
+        return self._measure('fetch_bugs', fetch, len(self.bugs))[0]
+
+    def run_save(self, bugs):
+        """
+        Save given bugs with `save_bugs`, the batched import path.
+        """
+        bz = self.get_api()
+        return self._measure('save_bugs', lambda: bz.save_bugs(bugs), len(bugs))[1]
+
+    def run_create(self, bugs):
+        """
+        Save given bugs one at a time with `_create_bug`, the unbatched ORM path.
+        """
+        bz = self.get_api()
+        return self._measure('_create_bug', lambda: [bz._create_bug(bug) for bug in bugs], len(bugs))[1]
+
+    def run_end_to_end(self):
+        """
+        Fetch and save all bugs page by page, as `fetch_bugzilla_bugs` does.
+        """
+        bz = self.get_api()
+        save = lambda: sum(bz.save_bugs(page) for page in bz.iter_bug_pages(page_size=self.page_size))
+        return self._measure('end_to_end', save, len(self.bugs))[1]
+
+
+def explain(queryset):
+    """
+    Run given queryset with EXPLAIN ANALYZE, return its plan as a dict (the JSON format's).
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    # psycopg2 decodes json columns itself, unless told not to
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def summarize_plan(node):
+    """
+    One line summary of the nodes of given plan (top down), e.g.
+    `Limit > Index Scan Backward using bug_last_change_time_idx`.
+    """
+    summary = node['Node Type']
+    if node.get('Index Name'):
+        summary += ' using %s' % node['Index Name']
+    children = [summarize_plan(child) for child in node.get('Plans', [])]
+    if children:
+        summary += ' > ' + ', '.join(children)
+    return summary
+
+
+class IndexBenchmark(object):
+    """
+    Times the workload queries (see `get_workload`) on the saved bugs with the indexes as they
+    are, then with `INDEXES` dropped, in a transaction that gets rolled back. Each query runs
+    `repeat` times and keeps its best time. Results are dicts (query, indexes, plan, ms) in `results`.
+
+    Dropping the indexes locks their tables until the rollback: run it on a staging database.
+    """
+    # Indexes added for the workload, by migration 0013
+    INDEXES = ('bug_last_change_time_idx', 'bug_creation_time_idx', 'bug_prod_comp_status_idx',
+               'bug_open_prod_comp_idx', 'comment_bug_creation_time_idx')
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = []
+
+    def get_workload(self):
+        """
+        List of (name, queryset) of the queries the indexes are for, with parameters
+        taken from the saved bugs: the component with the most open bugs, the last day
+        of changes and the last month of new bugs.
+        """
+        latest = models.Bug.objects.aggregate(changed=Max('last_change_time'), created=Max('creation_time'))
+        if latest['changed'] is None:
+            return []
+        component = models.BugCount.objects.filter(is_open=True).order_by('-count').values(
+            'product_id', 'component_id', 'status_id').first() or models.Bug.objects.values(
+            'product_id', 'component_id', 'status_id').first()
+        bug_pks = list(models.Bug.objects.order_by('-last_change_time').values_list('pk', flat=True)[:100])
+        return [
+            # What Max('last_change_time') of `get_sync_watermark` is planned as
+            ('sync watermark', models.Bug.objects.order_by('-last_change_time').values_list(
+                'last_change_time')[:1]),
+            ('changed in the last day', models.Bug.objects.filter(
+                last_change_time__gte=latest['changed'] - datetime.timedelta(days=1)).values_list('bz_id')),
+            ('created in the last month', models.Bug.objects.filter(
+                creation_time__gte=latest['created'] - datetime.timedelta(days=30)).values_list('bz_id')),
+            ('open bugs of a component', models.Bug.objects.filter(
+                is_open=True, product_id=component['product_id'],
+                component_id=component['component_id']).values_list('bz_id')),
+            ('bugs of a component in a status', models.Bug.objects.filter(**component).values_list('bz_id')),
+            ('latest comments of 100 bugs', models.Comment.objects.filter(bug_id__in=bug_pks).values_list(
+                'bug_id').annotate(latest=Max('creation_time'))),
+        ]
+
+    def _run_workload(self, workload, indexes):
+        for name, queryset in workload:
+            timings = []
+            for _ in range(self.repeat):
+                plan = explain(queryset)
+                timings.append(plan['Execution Time'])
+            self.results.append({
+                'query': name,
+                'indexes': indexes,
+                'plan': summarize_plan(plan['Plan']),
+                'ms': min(timings),
+            })
+
+    def run(self):
+        workload = self.get_workload()
+        self._run_workload(workload, 'with')
+        with transaction.atomic(), connection.cursor() as cursor:
+            for index in self.INDEXES:
+                cursor.execute('DROP INDEX IF EXISTS %s' % connection.ops.quote_name(index))
+            self._run_workload(workload, 'without')
+            transaction.set_rollback(True)
+        return self.results
@@ -0,0 +1,59 @@
+"""
+Ingestion of bug comments, many bugs per Bugzilla request.
+"""
+from django.db.models import Max
+
+from bugs import models
+from bugs.lookups import insert_ignoring_conflicts
+from bugs.third_party.bugzilla import BugzillaAPIError
+from bugs.utils import chunked
+
+
+class CommentImporter(object):
+    """
+    Saves the comments of saved bugs, `BATCH_SIZE` bugs per Bugzilla request.
+
+    Comments can't be edited on Bugzilla, so comments already saved are skipped, and
+    when every bug of a batch already has comments only the ones made after the
+    oldest of their latest comments are requested (`new_since`).
+    """
+    BATCH_SIZE = 100
+
+    def __init__(self, bz):
+        self.bz = bz
+        self.saved_count = 0
+
+    def _get_new_since(self, bug_pks):
+        latest = dict(models.Comment.objects.filter(bug_id__in=bug_pks).values_list(
+            'bug_id').annotate(latest=Max('creation_time')))
+        if len(latest) == len(bug_pks):
+            return min(latest.values())
+
+    def save_comments(self, bz_ids):
+        """
+        Fetch and save the comments of the given saved bugs. Returns the number of new comments saved.
+        """
+        for chunk in chunked(bz_ids, self.BATCH_SIZE):
+            pk_by_bz_id = dict(models.Bug.objects.filter(bz_id__in=chunk).values_list('bz_id', 'pk'))
+            if not pk_by_bz_id:
+                continue
+            success, comments_or_error = self.bz.fetch_comments(
+                list(pk_by_bz_id), self._get_new_since(pk_by_bz_id.values()))
+            if not success:
+                raise BugzillaAPIError("Comment fetch failure", comments_or_error)
+
+            comments = [comment for bug_comments in comments_or_error.values() for comment in bug_comments]
+            user_pks = self.bz.users.resolve({'email': comment['creator']} for comment in comments)
+            self.saved_count += insert_ignoring_conflicts(models.Comment, [
+                models.Comment(
+                    bz_id=comment['id'],
+                    bug_id=pk_by_bz_id[comment['bug_id']],
+                    count=comment['count'],
+                    creator_id=user_pks[comment['creator']],
+                    creation_time=comment['creation_time'],
+                    is_private=comment['is_private'],
+                    attachment_id=comment.get('attachment_id'),
+                    text=comment['text'],
+                ) for comment in comments
+            ])
+        return self.saved_count
@@ -0,0 +1,170 @@
+"""
+COPY based loader for cold-start imports of a whole tracker.
+
+Bug rows and their M2M rows are streamed with COPY into temporary staging tables,
+then merged into the real tables with a few INSERT ... SELECT statements,
+all in one transaction.
+"""
+import datetime
+import io
+import itertools
+import time
+
+import six
+
+from django.db import connection, transaction
+
+from bugs import models, rollups
+
+
+def _copy_text_value(value):
+    """
+    Format a db-prepared python value for COPY text format.
+    """
+    if value is None:
+        return u'\\N'
+    if isinstance(value, bool):
+        return u't' if value else u'f'
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        # Only integer arrays (blocks, depends_on, see_also) on Bug
+        return u'{%s}' % u','.join(six.text_type(item) for item in value)
+    return (six.text_type(value)
+            .replace(u'\\', u'\\\\')
+            .replace(u'\n', u'\\n')
+            .replace(u'\r', u'\\r')
+            .replace(u'\t', u'\\t'))
+
+
+class CopyLoader(object):
+    """
+    Load bug dicts (as returned by Bugzilla bugs API) with COPY.
+
+    Lookups and users are still resolved through the given BugzillaAPI's caches,
+    bugs whose bz_id already exists are left alone.
+
+        loader = CopyLoader(BugzillaAPI())
+        with transaction.atomic():
+            loader.create_staging_tables()
+            for chunk in chunks:
+                loader.stage(chunk)
+            loader.merge()
+    """
+    CHUNK_SIZE = 5000
+    BUG_STAGING_TABLE = 'bugs_bug_staging'
+    LOADED_BUGS_TABLE = 'bugs_bug_loaded'
+
+    def __init__(self, bz):
+        self.bz = bz
+        self.qn = connection.ops.quote_name
+        self.fields = [field for field in models.Bug._meta.concrete_fields if not field.primary_key]
+        self.timings = {'stage': 0.0, 'merge': 0.0}
+        self.staged_count = 0
+        self.loaded_count = 0
+
+    def _m2m_staging_table(self, field_name):
+        return 'bugs_bug_%s_staging' % field_name
+
+    def _execute(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def _copy(self, table, columns, rows):
+        buf = io.BytesIO()
+        for row in rows:
+            line = u'\t'.join(_copy_text_value(value) for value in row) + u'\n'
+            buf.write(line.encode('utf-8'))
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(
+                self.qn(table), ', '.join(columns)), buf)
+
+    def create_staging_tables(self):
+        """
+        Create the (transaction scoped) staging tables. Must be called inside a transaction.
+        """
+        columns = ', '.join(self.qn(field.column) for field in self.fields)
+        self._execute('CREATE TEMPORARY TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA'.format(
+            self.qn(self.BUG_STAGING_TABLE), columns, self.qn(models.Bug._meta.db_table)))
+        for field_name in self.bz.M2M_FIELDS:
+            self._execute(
+                'CREATE TEMPORARY TABLE {} (bz_id integer NOT NULL, target_id integer NOT NULL) '
+                'ON COMMIT DROP'.format(self.qn(self._m2m_staging_table(field_name))))
+        self._execute('CREATE TEMPORARY TABLE {} (id integer NOT NULL, bz_id integer NOT NULL) '
+                      'ON COMMIT DROP'.format(self.qn(self.LOADED_BUGS_TABLE)))
+
+    def stage(self, bug_details):
+        """
+        COPY given bug dicts, and the rows of their M2Ms, into the staging tables.
+        """
+        start = time.time()
+        self.bz._prime_lookups(bug_details)
+        self.bz._prime_users(bug_details)
+        bug_rows = []
+        m2m_rows = {field_name: set() for field_name in self.bz.M2M_FIELDS}
+        for bug_detail in bug_details:
+            bug = models.Bug(**self.bz._get_bug_values(bug_detail))
+            bug_rows.append([field.get_db_prep_save(getattr(bug, field.attname), connection)
+                             for field in self.fields])
+            for field_name, objs in self.bz._get_bug_m2m_values(bug_detail).items():
+                m2m_rows[field_name].update((bug_detail['id'], obj.pk) for obj in objs)
+
+        self._copy(self.BUG_STAGING_TABLE, [self.qn(field.column) for field in self.fields], bug_rows)
+        for field_name, rows in m2m_rows.items():
+            self._copy(self._m2m_staging_table(field_name), ['bz_id', 'target_id'], rows)
+        self.staged_count += len(bug_rows)
+        self.timings['stage'] += time.time() - start
+
+    def merge(self):
+        """
+        Move staged bugs not already saved into bugs_bug, the M2M rows of
+        the bugs actually inserted into the through-tables, and count them in BugCount.
+        Returns the number of bugs inserted.
+        """
+        start = time.time()
+        columns = ', '.join(self.qn(field.column) for field in self.fields)
+        # DISTINCT ON, as the same bug can be staged twice when pages shift while crawling
+        self.loaded_count = self._execute(
+            'WITH inserted AS ('
+            '    INSERT INTO {bug_table} ({columns})'
+            '    SELECT DISTINCT ON (bz_id) {columns} FROM {staging_table}'
+            '    ON CONFLICT (bz_id) DO NOTHING'
+            '    RETURNING id, bz_id'
+            ') INSERT INTO {loaded_table} (id, bz_id) SELECT id, bz_id FROM inserted'.format(
+                bug_table=self.qn(models.Bug._meta.db_table),
+                columns=columns,
+                staging_table=self.qn(self.BUG_STAGING_TABLE),
+                loaded_table=self.qn(self.LOADED_BUGS_TABLE),
+            ))
+        for field_name in self.bz.M2M_FIELDS:
+            field = models.Bug._meta.get_field(field_name)
+            self._execute(
+                'INSERT INTO {through_table} ({bug_column}, {target_column})'
+                ' SELECT DISTINCT loaded.id, staged.target_id'
+                ' FROM {staging_table} staged JOIN {loaded_table} loaded ON loaded.bz_id = staged.bz_id'.format(
+                    through_table=self.qn(field.remote_field.through._meta.db_table),
+                    bug_column=self.qn(field.m2m_column_name()),
+                    target_column=self.qn(field.m2m_reverse_name()),
+                    staging_table=self.qn(self._m2m_staging_table(field_name)),
+                    loaded_table=self.qn(self.LOADED_BUGS_TABLE),
+                ))
+        rollups.count_bugs_in_table(self.LOADED_BUGS_TABLE)
+        self.timings['merge'] += time.time() - start
+        return self.loaded_count
+
+    def load(self, bug_details, chunk_size=None):
+        """
+        Stage given iterable of bug dicts chunk by chunk and merge them, in one transaction.
+        Returns the number of bugs inserted.
+        """
+        bug_details = iter(bug_details)
+        with transaction.atomic():
+            self.create_staging_tables()
+            while True:
+                chunk = list(itertools.islice(bug_details, chunk_size or self.CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.stage(chunk)
+            return self.merge()
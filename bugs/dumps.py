@@ -0,0 +1,119 @@
+"""
+Offline dumps of Bugzilla bugs, so that crawling Bugzilla and loading the database can
+happen apart (e.g. load a staging database without touching the live tracker).
+
+A dump is a directory of gzipped JSON lines shards, one bug dict (as returned by the
+Bugzilla bugs API) per line, and a `manifest.json` listing them. It is written by the
+`dump_bugs` command and loaded by `replay_bugs`.
+"""
+import gzip
+import json
+import os
+
+from django.utils import timezone
+
+from bugs.third_party.jsonstream import loads
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _latest(*timestamps):
+    # Timestamps are all in the same ISO 8601 UTC format, so they compare as strings
+    return max([timestamp for timestamp in timestamps if timestamp] or [None])
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def iter_shard(directory, shard):
+    """
+    Yield the bug dicts of given shard (from the manifest of the dump in `directory`)
+    one at a time, decompressing and decoding it as it is read.
+    """
+    with gzip.open(os.path.join(directory, shard['file']), 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+class BugDumpWriter(object):
+    """
+    Writes bugs, in bug id order, into shards of `shard_size` bugs (`bugs-00000.jsonl.gz`,
+    `bugs-00001.jsonl.gz` ...) in `directory`, and the manifest listing them with the bug
+    count, first and last bug id and latest `last_change_time` (watermark) of each.
+    Keyword arguments are recorded in the manifest, e.g. the search terms of the dump.
+
+    A shard only gets its name and its manifest entry once complete, and the manifest is
+    rewritten after each, so an interrupted dump lists the bugs it got in full: with
+    `resume` the writer appends to it, and `last_bz_id` tells where to pick up.
+    `finished_at` is only set in the manifest of a dump that went all the way.
+    """
+    SHARD_SIZE = 10000
+
+    def __init__(self, directory, shard_size=None, resume=False, **info):
+        self.directory = directory
+        self.shard_size = shard_size or self.SHARD_SIZE
+        if resume and os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+            self.manifest = read_manifest(directory)
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.manifest = dict(info, started_at=timezone.now().isoformat(), finished_at=None,
+                                 bug_count=0, watermark=None, shards=[])
+        self._file = None
+        self._shard = None
+
+    @property
+    def last_bz_id(self):
+        if self.manifest['shards']:
+            return self.manifest['shards'][-1]['last_id']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            # The incomplete shard is left as .tmp, and written again when resuming
+            self._file.close()
+
+    def write(self, bug):
+        if self._file is None:
+            name = 'bugs-%05d.jsonl.gz' % len(self.manifest['shards'])
+            self._file = gzip.open(os.path.join(self.directory, name + '.tmp'), 'wb', compresslevel=6)
+            self._shard = {'file': name, 'count': 0, 'first_id': bug['id'], 'last_id': None, 'watermark': None}
+        self._file.write(json.dumps(bug, separators=(',', ':')).encode('utf-8') + b'\n')
+        self._shard['count'] += 1
+        self._shard['last_id'] = bug['id']
+        self._shard['watermark'] = _latest(self._shard['watermark'], bug.get('last_change_time'))
+        if self._shard['count'] >= self.shard_size:
+            self._close_shard()
+
+    def _close_shard(self):
+        self._file.close()
+        path = os.path.join(self.directory, self._shard['file'])
+        os.rename(path + '.tmp', path)
+        self.manifest['shards'].append(self._shard)
+        self.manifest['bug_count'] += self._shard['count']
+        self.manifest['watermark'] = _latest(self.manifest['watermark'], self._shard['watermark'])
+        self._write_manifest()
+        self._file = self._shard = None
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        # Atomic, readers never see half a manifest
+        os.rename(path + '.tmp', path)
+
+    def close(self):
+        """
+        Complete the last shard, and mark the dump finished in the manifest.
+        """
+        if self._file is not None:
+            self._close_shard()
+        self.manifest['finished_at'] = timezone.now().isoformat()
+        self._write_manifest()
@@ -0,0 +1,24 @@
+import django_filters
+from django_filters import rest_framework as filters
+
+from bugs import models
+
+
+class NameInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    """
+    Lookup name, or comma separated names (`?status=NEW,ASSIGNED`).
+    """
+
+
+class BugFilter(filters.FilterSet):
+    product = NameInFilter(field_name='product__name')
+    component = NameInFilter(field_name='component__name')
+    status = NameInFilter(field_name='status__name')
+    severity = NameInFilter(field_name='severity__name')
+    priority = NameInFilter(field_name='priority__name')
+    last_change_time_after = django_filters.IsoDateTimeFilter(field_name='last_change_time', lookup_expr='gte')
+    last_change_time_before = django_filters.IsoDateTimeFilter(field_name='last_change_time', lookup_expr='lt')
+
+    class Meta:
+        model = models.Bug
+        fields = ('product', 'component', 'status', 'severity', 'priority', 'is_open')
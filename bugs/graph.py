@@ -0,0 +1,268 @@
+"""
+In-memory index of the bug dependency graph (`Bug.depends_on` / `Bug.blocks`), for
+traversals over many bugs at once: transitive closure, dependency depth and cycles.
+"""
+import copy
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.db.models import Max
+
+from bugs import models
+
+
+class DependencyGraph(object):
+    """
+    Immutable adjacency index of the "depends on" edges between bugs, keyed by bz_id.
+
+    Bugs are numbered by their position in the sorted `ids` array, and the edges are
+    kept in compressed sparse row form: the bugs bug `i` depends on are
+    `depends_targets[depends_offsets[i]:depends_offsets[i + 1]]`, and the bugs it blocks
+    likewise in the `blocks_*` arrays. Flat integer arrays hold tens of thousands of bugs
+    in a few hundred KB, and traversals only index into them.
+
+    Edges are built from `depends_on` alone, as Bugzilla keeps `blocks` its mirror image.
+    Referenced bugs that aren't saved are nodes without dependencies of their own, until
+    an import saves them and `refreshed` reads them.
+    """
+    # Bugs imported up to this long before the watermark are read again by `refreshed`,
+    # for transactions still running (so not visible) when the watermark was read
+    REFRESH_OVERLAP = timedelta(minutes=5)
+
+    def __init__(self, adjacency, watermark=None):
+        """
+        `adjacency` is a dict of bz_id -> iterable of the bz ids it depends on,
+        `watermark` the latest `Bug.imported_at` it reflects.
+        """
+        self.watermark = watermark
+        nodes = set(adjacency)
+        for targets in adjacency.values():
+            nodes.update(targets)
+        self.ids = array('i', sorted(nodes))
+        position = {bz_id: i for i, bz_id in enumerate(self.ids)}
+
+        self.depends_offsets = array('i', [0])
+        self.depends_targets = array('i')
+        # Number of bugs each bug blocks, to lay the reverse edges out without sorting them
+        blocks_counts = array('i', [0]) * (len(self.ids) + 1)
+        for bz_id in self.ids:
+            targets = sorted(set(position[target] for target in adjacency.get(bz_id) or ()))
+            self.depends_targets.extend(targets)
+            self.depends_offsets.append(len(self.depends_targets))
+            for target in targets:
+                blocks_counts[target + 1] += 1
+
+        self.blocks_offsets = array('i', [0]) * (len(self.ids) + 1)
+        for i in range(len(self.ids)):
+            self.blocks_offsets[i + 1] = self.blocks_offsets[i] + blocks_counts[i + 1]
+        self.blocks_targets = array('i', [0]) * len(self.depends_targets)
+        fill = array('i', self.blocks_offsets[:-1])
+        for i in range(len(self.ids)):
+            for edge in range(self.depends_offsets[i], self.depends_offsets[i + 1]):
+                target = self.depends_targets[edge]
+                self.blocks_targets[fill[target]] = i
+                fill[target] += 1
+
+        self._components = None
+        self._depths = None
+
+    @classmethod
+    def load(cls):
+        """
+        Build the graph of all saved bugs, with one query for the edges.
+        """
+        # Read first: changes made while the edges are read get picked up by the next refresh
+        watermark = models.Bug.objects.aggregate(latest=Max('imported_at'))['latest']
+        adjacency = dict(models.Bug.objects.exclude(depends_on=None).exclude(depends_on=[]).values_list(
+            'bz_id', 'depends_on').iterator())
+        return cls(adjacency, watermark)
+
+    def refreshed(self):
+        """
+        Return the graph updated with the bugs imported since it was built or refreshed (only
+        those are read from the database), or this graph if none of their dependencies changed.
+
+        This goes by import time rather than Bugzilla's `last_change_time`, so that bugs
+        imported out of change order (e.g. replayed dumps, or bugs only fetched as the
+        targets of links) are picked up too.
+        """
+        if self.watermark is None:
+            return self.load()
+        changed = list(models.Bug.objects.filter(
+            imported_at__gte=self.watermark - self.REFRESH_OVERLAP).values_list('bz_id', 'depends_on', 'imported_at'))
+        if not changed:
+            return self
+        watermark = max(self.watermark, max(imported_at for _, _, imported_at in changed))
+        changed = {bz_id: sorted(set(depends_on or ())) for bz_id, depends_on, _ in changed}
+        if all(self.get_dependencies(bz_id) == depends_on for bz_id, depends_on in changed.items()):
+            # e.g. only comments or statuses changed
+            graph = copy.copy(self)
+            graph.watermark = watermark
+            return graph
+        adjacency = dict(self._iter_adjacency())
+        adjacency.update(changed)
+        return type(self)(adjacency, watermark)
+
+    def _iter_adjacency(self):
+        for i, bz_id in enumerate(self.ids):
+            if self.depends_offsets[i] != self.depends_offsets[i + 1]:
+                yield bz_id, [self.ids[target] for target in self._targets(i, models.BugLink.DEPENDS_ON)]
+
+    def _position(self, bz_id):
+        i = bisect_left(self.ids, bz_id)
+        if i < len(self.ids) and self.ids[i] == bz_id:
+            return i
+
+    def _targets(self, i, kind):
+        if kind == models.BugLink.DEPENDS_ON:
+            return self.depends_targets[self.depends_offsets[i]:self.depends_offsets[i + 1]]
+        return self.blocks_targets[self.blocks_offsets[i]:self.blocks_offsets[i + 1]]
+
+    def __contains__(self, bz_id):
+        return self._position(bz_id) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_dependencies(self, bz_id, kind=models.BugLink.DEPENDS_ON):
+        """
+        Sorted list of the bz ids given bug directly depends on (or blocks, for `BugLink.BLOCKS`).
+        """
+        i = self._position(bz_id)
+        if i is None:
+            return []
+        return [self.ids[target] for target in self._targets(i, kind)]
+
+    def closure(self, bz_ids, kind=models.BugLink.DEPENDS_ON):
+        """
+        Set of the bz ids the given bugs transitively depend on, e.g. everything blocking
+        a release tracker bug (or that they transitively block, for `BugLink.BLOCKS`).
+        The given bugs are left out, unless part of a cycle.
+        """
+        seen = bytearray(len(self.ids))
+        queue = [i for i in (self._position(bz_id) for bz_id in bz_ids) if i is not None]
+        reached = set()
+        while queue:
+            i = queue.pop()
+            for target in self._targets(i, kind):
+                if not seen[target]:
+                    seen[target] = 1
+                    reached.add(self.ids[target])
+                    queue.append(target)
+        return reached
+
+    def _get_components(self):
+        """
+        Strongly connected components of the "depends on" edges (iterative Tarjan), as
+        (array of bug -> its component, list of components as lists of bugs). Components
+        come out in reverse topological order: each after all the ones it depends on.
+        """
+        if self._components is not None:
+            return self._components
+        count = len(self.ids)
+        index = array('i', [-1]) * count
+        low = array('i', [0]) * count
+        on_stack = bytearray(count)
+        component_of = array('i', [-1]) * count
+        components = []
+        stack = []
+        counter = 0
+        for root in range(count):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            # (bug, next edge of it to follow)
+            work = [(root, self.depends_offsets[root])]
+            while work:
+                i, edge = work[-1]
+                if edge < self.depends_offsets[i + 1]:
+                    work[-1] = (i, edge + 1)
+                    target = self.depends_targets[edge]
+                    if index[target] == -1:
+                        index[target] = low[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = 1
+                        work.append((target, self.depends_offsets[target]))
+                    elif on_stack[target]:
+                        low[i] = min(low[i], index[target])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[i])
+                if low[i] == index[i]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component_of[member] = len(components)
+                        component.append(member)
+                        if member == i:
+                            break
+                    components.append(component)
+        self._components = component_of, components
+        return self._components
+
+    def cycles(self):
+        """
+        List of the dependency cycles, each as the sorted list of the bz ids caught in it.
+        """
+        component_of, components = self._get_components()
+        return [
+            sorted(self.ids[i] for i in component) for component in components
+            if len(component) > 1 or component[0] in self._targets(component[0], models.BugLink.DEPENDS_ON)
+        ]
+
+    def _get_depths(self):
+        if self._depths is not None:
+            return self._depths
+        component_of, components = self._get_components()
+        depths = array('i', [0]) * len(components)
+        # Dependencies come first, so their depth is final when a component needs it
+        for number, component in enumerate(components):
+            for i in component:
+                for target in self._targets(i, models.BugLink.DEPENDS_ON):
+                    if component_of[target] != number:
+                        depths[number] = max(depths[number], depths[component_of[target]] + 1)
+        self._depths = component_of, depths
+        return self._depths
+
+    def depth(self, bz_id):
+        """
+        Length of the longest chain of dependencies under given bug: 0 if it depends on
+        nothing, 1 if it only depends on bugs without dependencies, etc.
+        A cycle counts as one link of the chain.
+        """
+        return self.depths([bz_id])[bz_id]
+
+    def depths(self, bz_ids):
+        """
+        Dict of bz_id -> `depth` of the given bugs.
+        """
+        component_of, depths = self._get_depths()
+        positions = ((bz_id, self._position(bz_id)) for bz_id in bz_ids)
+        return {bz_id: depths[component_of[i]] if i is not None else 0 for bz_id, i in positions}
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_graph(refresh=True):
+    """
+    The process-wide DependencyGraph, built the first time, then refreshed with
+    the bugs imported since (one query) unless `refresh` is False.
+    """
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = DependencyGraph.load()
+        elif refresh:
+            _graph = _graph.refreshed()
+        return _graph
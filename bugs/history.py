@@ -0,0 +1,83 @@
+"""
+Ingestion of bug histories (changelogs), many bugs per Bugzilla request.
+"""
+from django.db import transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
+
+from bugs import models
+from bugs.third_party.bugzilla import BugzillaAPIError
+
+
+class HistoryImporter(object):
+    """
+    Appends the changes made to saved bugs since the latest one saved for each bug,
+    `BATCH_SIZE` bugs per Bugzilla request.
+
+    Only the changes made after the oldest latest change of a batch are requested
+    (`new_since`, the bug's creation time for bugs without history yet), and bugs are
+    batched in order of their latest change, so that each batch's `new_since` fits all
+    of its bugs closely and little history is transferred twice.
+    """
+    BATCH_SIZE = 100
+
+    def __init__(self, bz):
+        self.bz = bz
+        self.saved_count = 0
+
+    def _get_last_seen(self, bug_pks):
+        """
+        Dict of bug pk -> time of its latest change saved, for the bugs that have history.
+        """
+        return dict(models.BugHistoryEntry.objects.filter(bug_id__in=bug_pks).values_list(
+            'bug_id').annotate(latest=Max('when')))
+
+    def _get_batches(self, bz_ids):
+        bugs = list(models.Bug.objects.filter(bz_id__in=bz_ids).values_list('pk', 'bz_id', 'creation_time'))
+        last_seen = {}
+        for i in range(0, len(bugs), self.BATCH_SIZE * 10):
+            last_seen.update(self._get_last_seen([pk for pk, _, _ in bugs[i:i + self.BATCH_SIZE * 10]]))
+        bugs = sorted((last_seen.get(pk, creation_time), pk, bz_id) for pk, bz_id, creation_time in bugs)
+        for i in range(0, len(bugs), self.BATCH_SIZE):
+            batch = bugs[i:i + self.BATCH_SIZE]
+            # The oldest, as the batch is sorted
+            yield batch[0][0], {bz_id: pk for _, pk, bz_id in batch}
+
+    def save_history(self, bz_ids):
+        """
+        Fetch and append the new history of the given saved bugs. Returns the number of changes saved.
+        """
+        for new_since, pk_by_bz_id in self._get_batches(bz_ids):
+            success, history_or_error = self.bz.fetch_history(list(pk_by_bz_id), new_since)
+            if not success:
+                raise BugzillaAPIError("History fetch failure", history_or_error)
+
+            user_pks = self.bz.users.resolve(
+                {'email': entry['who']} for history in history_or_error.values() for entry in history)
+            with transaction.atomic():
+                # Locks the bugs, so that imports of the same bugs running concurrently
+                # append each change once: what is older than a bug's latest change is already saved
+                list(models.Bug.objects.select_for_update().filter(
+                    pk__in=pk_by_bz_id.values()).values_list('pk', flat=True))
+                last_seen = self._get_last_seen(pk_by_bz_id.values())
+                entries = []
+                for bz_id, history in history_or_error.items():
+                    bug_pk = pk_by_bz_id[bz_id]
+                    for entry in history:
+                        when = parse_datetime(entry['when'])
+                        if bug_pk in last_seen and when <= last_seen[bug_pk]:
+                            continue
+                        entries.extend(
+                            models.BugHistoryEntry(
+                                bug_id=bug_pk,
+                                when=when,
+                                who_id=user_pks.get(entry['who']),
+                                field_name=change['field_name'],
+                                removed=change['removed'],
+                                added=change['added'],
+                                attachment_id=change.get('attachment_id'),
+                            ) for change in entry['changes']
+                        )
+                models.BugHistoryEntry.objects.bulk_create(entries, batch_size=1000)
+            self.saved_count += len(entries)
+        return self.saved_count
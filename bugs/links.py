@@ -0,0 +1,142 @@
+"""
+Materializes the bug to bug references stored on Bug (blocks, depends_on, dupe_of, see_also)
+as BugLink rows, fetching the referenced bugs we don't have yet in bulk.
+"""
+import logging
+
+from django.db import transaction
+
+from bugs import models
+from bugs.lookups import insert_ignoring_conflicts
+from bugs.third_party.bugzilla import BugzillaAPIError
+from bugs.utils import chunked
+
+logger = logging.getLogger(__name__)
+
+
+class BugLinkResolver(object):
+    """
+    Flattened replacement of the recursive `_clear_pending_fk_and_m2m_to_self` design.
+
+    Bugs are processed as a work queue in rounds: the references of all bugs in the queue
+    are collected, the referenced bugs not saved yet are fetched with bulk `id=` searches
+    (`FETCH_SIZE` ids per request) and saved, then the links of the queued bugs are written.
+    The freshly fetched bugs make the queue of the next round, up to `max_rounds` rounds.
+    A visited set makes sure no bug is processed or fetched twice.
+    """
+    LINK_FIELDS = (models.BugLink.BLOCKS, models.BugLink.DEPENDS_ON,
+                   models.BugLink.DUPE_OF, models.BugLink.SEE_ALSO)
+    # Bug ids per Bugzilla request for the missing bugs
+    FETCH_SIZE = 200
+    # Bugs whose references are loaded and linked at once
+    BATCH_SIZE = 1000
+    MAX_ROUNDS = 10
+
+    def __init__(self, bz, max_rounds=None):
+        self.bz = bz
+        self.max_rounds = self.MAX_ROUNDS if max_rounds is None else max_rounds
+        # Ids Bugzilla didn't return (private or deleted bugs), never asked for again
+        self.unavailable = set()
+        self.fetched_count = 0
+        self.linked_count = 0
+
+    def _get_references(self, bz_ids):
+        """
+        Return dict of bz_id -> {link kind: list of referenced bz ids} for given saved bugs.
+        """
+        references = {}
+        for row in models.Bug.objects.filter(bz_id__in=bz_ids).values_list('bz_id', *self.LINK_FIELDS):
+            references[row[0]] = {}
+            for kind, value in zip(self.LINK_FIELDS, row[1:]):
+                if kind == models.BugLink.DUPE_OF:
+                    value = [value] if value else []
+                references[row[0]][kind] = value or []
+        return references
+
+    def _get_saved(self, bz_ids):
+        """
+        Return dict of bz_id -> pk of the given bugs that are saved.
+        """
+        pk_by_bz_id = {}
+        for chunk in chunked(bz_ids, self.BATCH_SIZE):
+            pk_by_bz_id.update(models.Bug.objects.filter(bz_id__in=chunk).values_list('bz_id', 'pk'))
+        return pk_by_bz_id
+
+    def _fetch_missing(self, bz_ids):
+        """
+        Fetch and save the given bugs from Bugzilla. Returns set of the bz ids saved.
+        """
+        fetched = set()
+        for chunk in chunked(bz_ids, self.FETCH_SIZE):
+            success, bugs_or_error = self.bz.fetch_bugs(get_params={'id': ','.join(map(str, chunk))})
+            if not success:
+                raise BugzillaAPIError("Couldn't fetch referenced bugs", bugs_or_error)
+            self.bz.save_bugs(bugs_or_error)
+            returned = set(bug_detail['id'] for bug_detail in bugs_or_error)
+            self.unavailable.update(set(chunk) - returned)
+            fetched.update(returned)
+        self.fetched_count += len(fetched)
+        return fetched
+
+    def _save_links(self, references):
+        """
+        Make the links of the given bugs match their references, skipping references to
+        bugs that are not saved.
+        """
+        targets = set()
+        for kinds in references.values():
+            for referenced in kinds.values():
+                targets.update(referenced)
+        pk_by_bz_id = self._get_saved(targets.union(references))
+        links = set(
+            (pk_by_bz_id[bz_id], pk_by_bz_id[target], kind)
+            for bz_id, kinds in references.items()
+            for kind, referenced in kinds.items()
+            for target in referenced
+            if target in pk_by_bz_id
+        )
+        with transaction.atomic():
+            current_links = {
+                (from_bug_id, to_bug_id, kind): pk
+                for pk, from_bug_id, to_bug_id, kind in models.BugLink.objects.filter(
+                    from_bug_id__in=[pk_by_bz_id[bz_id] for bz_id in references]
+                ).values_list('pk', 'from_bug_id', 'to_bug_id', 'kind')
+            }
+            stale_link_pks = [pk for link, pk in current_links.items() if link not in links]
+            if stale_link_pks:
+                models.BugLink.objects.filter(pk__in=stale_link_pks).delete()
+            insert_ignoring_conflicts(models.BugLink, [
+                models.BugLink(from_bug_id=from_bug_id, to_bug_id=to_bug_id, kind=kind)
+                for from_bug_id, to_bug_id, kind in links.difference(current_links)
+            ])
+        self.linked_count += len(links)
+
+    def resolve(self, bz_ids=None):
+        """
+        Materialize the links of the given saved bugs (all bugs if not given),
+        fetching the bugs they refer to that aren't saved yet, and so on.
+        Returns the number of bugs fetched.
+        """
+        if bz_ids is None:
+            bz_ids = models.Bug.objects.values_list('bz_id', flat=True)
+        queue = set(bz_ids)
+        visited = set()
+        rounds = 0
+        while queue:
+            logger.info("Resolving links of %d bugs (round %d)", len(queue), rounds + 1)
+            visited.update(queue)
+            next_queue = set()
+            for chunk in chunked(queue, self.BATCH_SIZE):
+                references = self._get_references(chunk)
+                if rounds < self.max_rounds:
+                    referenced = set()
+                    for kinds in references.values():
+                        for targets in kinds.values():
+                            referenced.update(targets)
+                    referenced.difference_update(visited, self.unavailable)
+                    missing = referenced.difference(self._get_saved(referenced))
+                    next_queue.update(self._fetch_missing(missing))
+                self._save_links(references)
+            queue = next_queue.difference(visited)
+            rounds += 1
+        return self.fetched_count
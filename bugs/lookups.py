@@ -0,0 +1,171 @@
+"""
+In-memory caches used while importing bugs, so that lookup rows that were
+already seen don't cost a query per bug.
+"""
+import threading
+
+from cachetools import LRUCache
+from psycopg2.extras import execute_values
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+
+def insert_ignoring_conflicts(model, objs):
+    """
+    Insert given (unsaved) instances with one statement, skipping the ones that
+    conflict with an existing row on a unique constraint.
+    Unlike bulk_create this never fails when other imports insert the same rows concurrently.
+    Returns the number of rows actually inserted.
+    """
+    if not objs:
+        return 0
+    qn = connection.ops.quote_name
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    sql = 'INSERT INTO {} ({}) VALUES %s ON CONFLICT DO NOTHING'.format(
+        qn(model._meta.db_table), ', '.join(qn(field.column) for field in fields))
+    rows = [
+        tuple(field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields)
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        # A single page, so that rowcount covers every row
+        execute_values(cursor.cursor, sql, rows, page_size=len(rows))
+        return cursor.rowcount
+
+
+class LookupCache(object):
+    """
+    natural key -> pk cache for the SingleFieldModelBase models (Product, Status, Keyword etc).
+    The natural key (`NATURAL_KEY` of the model) is the name, or a tuple of the key
+    fields' values for models with several, e.g. (product, name) for Component.
+
+    The table of a model is preloaded with one query the first time the model is
+    looked up, after that only keys never seen before hit the database, and those
+    are created with one bulk INSERT per call to `resolve`.
+
+    By default the cache lives as long as the instance (one import). With `shared=True`
+    a process-wide LRU cache of at most `SHARED_MAXSIZE` keys per model is used
+    instead, so consecutive imports in the same worker process don't preload again.
+    """
+    SHARED_MAXSIZE = 5000
+
+    _shared_maps = {}
+    _shared_lock = threading.RLock()
+
+    def __init__(self, shared=False):
+        self.shared = shared
+        self._maps = {}
+        self._lock = self._shared_lock if shared else threading.RLock()
+
+    def _iter_keys_and_pks(self, queryset):
+        fields = queryset.model.NATURAL_KEY
+        for row in queryset.values_list(*(fields + ('pk', ))):
+            yield row[0] if len(fields) == 1 else row[:-1], row[-1]
+
+    def _get_map(self, model):
+        maps = self._shared_maps if self.shared else self._maps
+        if model not in maps:
+            key_to_pk = LRUCache(maxsize=self.SHARED_MAXSIZE) if self.shared else {}
+            key_to_pk.update(self._iter_keys_and_pks(model.objects.all()))
+            maps[model] = key_to_pk
+        return maps[model]
+
+    def _find(self, model, keys):
+        """
+        Return key -> pk of the rows of the given keys that exist.
+        """
+        fields = model.NATURAL_KEY
+        if len(fields) == 1:
+            return dict(self._iter_keys_and_pks(model.objects.filter(**{fields[0] + '__in': keys})))
+        # One IN per key field, the rows matching them are narrowed down to the exact keys
+        queryset = model.objects.filter(**{
+            field + '__in': set(key[i] for key in keys) for i, field in enumerate(fields)
+        })
+        return {key: pk for key, pk in self._iter_keys_and_pks(queryset) if key in keys}
+
+    def _create_missing(self, model, keys):
+        """
+        Create rows for the given keys and return key -> pk for them.
+        """
+        fields = model.NATURAL_KEY
+        # Some of them could get created meanwhile by another import
+        insert_ignoring_conflicts(model, [
+            model(**dict(zip(fields, key if len(fields) > 1 else (key, )))) for key in keys
+        ])
+        return self._find(model, keys)
+
+    def resolve(self, model, keys):
+        """
+        Given a lookup model and an iterable of natural keys (names),
+        return dict of key -> pk, creating the rows for unseen keys.
+        """
+        keys = set(keys)
+        with self._lock:
+            key_to_pk = self._get_map(model)
+            resolved = {key: key_to_pk[key] for key in keys if key in key_to_pk}
+            missing = keys.difference(resolved)
+            if missing:
+                # Could have been evicted from the shared cache, or created after preloading.
+                found = self._find(model, missing)
+                missing.difference_update(found)
+                if missing:
+                    found.update(self._create_missing(model, missing))
+                key_to_pk.update(found)
+                resolved.update(found)
+        return resolved
+
+    def get_pk(self, model, key):
+        return self.resolve(model, [key])[key]
+
+    def clear(self):
+        with self._lock:
+            if self.shared:
+                self._shared_maps.clear()
+            self._maps.clear()
+
+
+class UserResolver(object):
+    """
+    email -> pk cache for Bugzilla users (assignees, creators, QA contacts and CCs).
+
+    Users are keyed on email only, the real name is just used when creating them,
+    as it can change on Bugzilla side while the email stays the same.
+    Emails not in the cache are fetched with one `email__in` query per call to
+    `resolve` and the ones not in the database are created with one bulk INSERT.
+    """
+
+    def __init__(self):
+        self.model = get_user_model()
+        self._email_to_pk = {}
+        self._lock = threading.RLock()
+
+    def _create_missing(self, names):
+        """
+        names: dict of email -> real name of users to be created.
+        Return email -> pk for them.
+        """
+        max_length = self.model._meta.get_field('name').max_length
+        # Some of them could get created meanwhile by another import
+        insert_ignoring_conflicts(self.model, [
+            self.model(email=email, name=name[:max_length]) for email, name in names.items()
+        ])
+        return dict(self.model.objects.filter(email__in=names).values_list('email', 'pk'))
+
+    def resolve(self, user_details):
+        """
+        Given an iterable of Bugzilla user dicts (`email` and `real_name`),
+        return dict of email -> pk, creating the users not in the database yet.
+        """
+        names = {}
+        for detail in user_details:
+            names.setdefault(detail['email'], detail.get('real_name') or '')
+        with self._lock:
+            missing = set(names).difference(self._email_to_pk)
+            if missing:
+                found = dict(self.model.objects.filter(email__in=missing).values_list('email', 'pk'))
+                missing.difference_update(found)
+                if missing:
+                    found.update(self._create_missing({email: names[email] for email in missing}))
+                self._email_to_pk.update(found)
+            return {email: self._email_to_pk[email] for email in names}
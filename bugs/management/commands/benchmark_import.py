@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bugs.benchmark import BugGenerator, ImportBenchmark
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the bug import against a local Bugzilla stand-in serving synthetic bugs, "
+            "reporting bugs/sec, queries per bug and the memory taken by each stage (RSS increase). "
+            "Nothing written to the database is kept.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bugs', type=int, default=2000, help="Number of synthetic bugs.")
+        parser.add_argument('--cc-size', type=float, default=3, help="Average number of CCs per bug.")
+        parser.add_argument('--keywords', type=int, default=30, help="Number of distinct keywords.")
+        parser.add_argument('--flags', type=int, default=10, help="Number of distinct flags.")
+        parser.add_argument('--link-density', type=float, default=0.5,
+                            help="Average number of references to other bugs per bug.")
+        parser.add_argument('--create-bugs', type=int, default=200,
+                            help="Number of bugs saved one by one with _create_bug (0 to skip).")
+        parser.add_argument('--page-size', type=int, default=None, help="Number of bugs per request.")
+        parser.add_argument('--concurrency', type=int, default=None, help="Number of pages fetched in parallel.")
+        parser.add_argument('--first-id', type=int, default=900000000,
+                            help="Id of the first synthetic bug, far from real ones so none get skipped.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = BugGenerator(first_id=options['first_id'], cc_size=options['cc_size'],
+                                 keywords=options['keywords'], flags=options['flags'],
+                                 link_density=options['link_density'], seed=options['seed'])
+        bugs = generator.generate(options['bugs'] + options['create_bugs'])
+        bugs, create_bugs = bugs[:options['bugs']], bugs[options['bugs']:]
+
+        with ImportBenchmark(bugs, page_size=options['page_size'], concurrency=options['concurrency']) as benchmark:
+            fetched = benchmark.run_fetch()
+            # Each saving stage starts from an empty slate, and leaves nothing behind
+            for run in (lambda: benchmark.run_save(fetched),
+                        lambda: benchmark.run_create(create_bugs) if create_bugs else None,
+                        benchmark.run_end_to_end):
+                with transaction.atomic():
+                    run()
+                    transaction.set_rollback(True)
+
+        self.stdout.write("%-12s %8s %9s %10s %9s %11s %13s" % (
+            'stage', 'bugs', 'seconds', 'bugs/sec', 'queries', 'queries/bug', 'RSS +MB'))
+        for result in benchmark.results:
+            # Unknown where /proc isn't available
+            rss = '-' if result['rss_increase_mb'] is None else '%.1f' % result['rss_increase_mb']
+            self.stdout.write("%(stage)-12s %(bugs)8d %(seconds)9.2f %(bugs_per_sec)10.1f %(queries)9d "
+                              "%(queries_per_bug)11.2f %(rss)13s" % dict(result, rss=rss))
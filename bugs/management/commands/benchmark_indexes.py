@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bugs.benchmark import IndexBenchmark
+
+
+class Command(BaseCommand):
+    help = ("Compare the query plans and timings of the importer's and reports' queries with and "
+            "without the indexes added for them, on the saved bugs. The indexes are dropped in a "
+            "transaction that gets rolled back, which locks the bug tables meanwhile: "
+            "run it on a staging database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help="Runs of each query, the best one counts.")
+
+    def handle(self, *args, **options):
+        benchmark = IndexBenchmark(repeat=options['repeat'])
+        results = benchmark.run()
+        if not results:
+            raise CommandError("No bugs saved to query")
+        for result in results:
+            self.stdout.write("%(query)-32s %(indexes)-8s %(ms)10.2f ms  %(plan)s" % result)
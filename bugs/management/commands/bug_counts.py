@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils.dateparse import parse_date
+
+from bugs import models, rollups
+
+
+class Command(BaseCommand):
+    help = ("Show bug counts from the BugCount rollup, grouped by some of product, component, "
+            "severity, status and is_open. Can also rebuild the rollup or take its daily snapshot.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group-by', default='product,status',
+                            help="Comma separated dimensions to count by.")
+        parser.add_argument('--open', action='store_true', help="Only count open bugs.")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Recompute the rollup from all saved bugs first.")
+        parser.add_argument('--snapshot', nargs='?', const='today', default=None, metavar='DATE',
+                            help="Save the current counts as the snapshot of DATE (YYYY-MM-DD, default today).")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write("Rebuilt %d bug count rows" % rollups.rebuild())
+        if options['snapshot']:
+            date = None if options['snapshot'] == 'today' else parse_date(options['snapshot'])
+            if options['snapshot'] != 'today' and date is None:
+                raise CommandError("--snapshot takes a YYYY-MM-DD date")
+            self.stdout.write("Saved %d bug count snapshot rows" % rollups.take_snapshot(date))
+            return
+
+        group_by = [name.strip() for name in options['group_by'].split(',') if name.strip()]
+        unknown = set(group_by).difference(rollups.DIMENSIONS)
+        if unknown:
+            raise CommandError("Unknown dimensions: %s" % ', '.join(sorted(unknown)))
+        values = [rollups.DIMENSIONS[name] for name in group_by]
+        counts = models.BugCount.objects.all()
+        if options['open']:
+            counts = counts.filter(is_open=True)
+        for row in counts.values_list(*values).annotate(total=Sum('count')).order_by(*values):
+            if row[-1]:
+                self.stdout.write(u'%s\t%d' % (u'\t'.join(u'%s' % value for value in row[:-1]), row[-1]))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bugs import models
+from bugs.graph import get_graph
+
+
+class Command(BaseCommand):
+    help = ("Show the bugs the given bugs transitively depend on (or block), with the depth of "
+            "their dependency chains, or list the dependency cycles.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('bz_ids', nargs='*', type=int, metavar='BZ_ID')
+        parser.add_argument('--blocked', action='store_true',
+                            help="Show the bugs the given bugs block instead of the ones blocking them.")
+        parser.add_argument('--open', action='store_true', help="Only show open bugs.")
+        parser.add_argument('--cycles', action='store_true', help="List the dependency cycles.")
+
+    def handle(self, *args, **options):
+        graph = get_graph()
+        self.stderr.write("Dependency graph of %d bugs" % len(graph))
+        if options['cycles']:
+            for cycle in graph.cycles():
+                self.stdout.write(' '.join(str(bz_id) for bz_id in cycle))
+            return
+        if not options['bz_ids']:
+            raise CommandError("Give the bugs to start from, or --cycles")
+
+        kind = models.BugLink.BLOCKS if options['blocked'] else models.BugLink.DEPENDS_ON
+        bugs = models.Bug.objects.filter(bz_id__in=graph.closure(options['bz_ids'], kind))
+        if options['open']:
+            bugs = bugs.filter(is_open=True)
+        rows = list(bugs.values_list('bz_id', 'status__name', 'summary'))
+        depths = graph.depths(bz_id for bz_id, _, _ in rows)
+        # Deepest chains first, the ones to start on are at the bottom
+        for bz_id, status, summary in sorted(rows, key=lambda row: (-depths[row[0]], row[0])):
+            self.stdout.write(u'%d\t%d\t%s\t%s' % (bz_id, depths[bz_id], status, summary))
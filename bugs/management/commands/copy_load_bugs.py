@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bugs.copy_loader import CopyLoader
+from bugs.third_party.bugzilla import BugzillaAPI
+from bugs.third_party.jsonstream import iter_file_chunks, iter_json_array
+
+
+class Command(BaseCommand):
+    help = ("Initial full import of bugs using COPY into staging tables, "
+            "from a Bugzilla bugs API JSON dump or straight from Bugzilla.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', dest='path',
+                            help="Bugzilla bugs API JSON dump to load (e.g. /tmp/bugs.json), "
+                                 "bugs are fetched from Bugzilla if not given.")
+        parser.add_argument('--chunk-size', type=int, default=CopyLoader.CHUNK_SIZE,
+                            help="Number of bugs per COPY into the staging tables.")
+        parser.add_argument('--page-size', type=int, default=None,
+                            help="Number of bugs per Bugzilla request when fetching.")
+
+    def handle(self, *args, **options):
+        bz = BugzillaAPI()
+        loader = CopyLoader(bz)
+        start = time.time()
+        if options['path']:
+            # Decoded as the file is read, so the dump never has to fit in memory
+            with open(options['path'], 'rb') as f:
+                loaded_count = loader.load(iter_json_array(iter_file_chunks(f), 'bugs'),
+                                           chunk_size=options['chunk_size'])
+        else:
+            loaded_count = loader.load(bz.iter_bugs(page_size=options['page_size']),
+                                       chunk_size=options['chunk_size'])
+        total = time.time() - start
+
+        self.stdout.write("Loaded %d new bugs out of %d in %.2fs (%.1f bugs/sec)" % (
+            loaded_count, loader.staged_count, total, loader.staged_count / total if total else 0))
+        self.stdout.write("  read/fetch:       %.2fs" % (total - loader.timings['stage'] - loader.timings['merge']))
+        self.stdout.write("  transform + COPY: %.2fs" % loader.timings['stage'])
+        self.stdout.write("  merge:            %.2fs" % loader.timings['merge'])
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import utc
+
+from bugs.dumps import BugDumpWriter
+from bugs.third_party.bugzilla import BugzillaAPI
+
+
+class Command(BaseCommand):
+    help = ("Crawl bugs from Bugzilla into a dump directory of gzipped JSON lines shards "
+            "and a manifest, to be loaded with replay_bugs.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--since', help="Only dump bugs (of every status) changed since this "
+                                            "UTC date and time, e.g. 2019-01-01T00:00:00Z.")
+        parser.add_argument('--shard-size', type=int, default=BugDumpWriter.SHARD_SIZE,
+                            help="Number of bugs per shard.")
+        parser.add_argument('--page-size', type=int, default=None,
+                            help="Number of bugs per Bugzilla request.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Continue an interrupted dump into the same directory.")
+
+    def handle(self, *args, **options):
+        bz = BugzillaAPI()
+        params = dict(bz.search_terms)
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError("--since takes a date and time, e.g. 2019-01-01T00:00:00Z")
+            params.update(bug_status='__all__', last_change_time=since.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+        writer = BugDumpWriter(options['directory'], options['shard_size'], resume=options['resume'],
+                               url_base=bz.url_base, params=params)
+        # Resumed dumps go on with the search terms they started with
+        params = writer.manifest['params']
+        if writer.last_bz_id:
+            self.stderr.write("Resuming after bug %d" % writer.last_bz_id)
+            params = bz._add_search_criterion(params, 'bug_id', 'greaterthan', writer.last_bz_id)
+        with writer:
+            for bug in bz.iter_bugs(page_size=options['page_size'], get_params=params):
+                writer.write(bug)
+        self.stdout.write("Dumped %d bugs in %d shards, last changed at %s" % (
+            writer.manifest['bug_count'], len(writer.manifest['shards']), writer.manifest['watermark']))
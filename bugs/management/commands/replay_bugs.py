@@ -0,0 +1,48 @@
+import time
+
+from celery import chord
+from django.core.management.base import BaseCommand
+
+from bugs import tasks
+from bugs.dumps import iter_shard, read_manifest
+from bugs.metrics import import_run
+from bugs.third_party.bugzilla import BugzillaAPI
+
+
+class Command(BaseCommand):
+    help = "Load a dump written by dump_bugs into the database, one shard at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--update-existing', action='store_true',
+                            help="Update the bugs already saved, instead of skipping them.")
+        parser.add_argument('--parallel', action='store_true',
+                            help="Replay each shard in its own celery task instead, on as many workers "
+                                 "as are running. The workers must see the dump directory.")
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        manifest = read_manifest(directory)
+        if not manifest['finished_at']:
+            self.stderr.write("The dump didn't finish, only its %d complete shards are replayed"
+                              % len(manifest['shards']))
+
+        if options['parallel']:
+            chord(
+                tasks.replay_bug_shard.s(directory, shard, options['update_existing'])
+                for shard in manifest['shards']
+            )(tasks.finish_bug_replay.s())
+            self.stdout.write("Dispatched %d shards" % len(manifest['shards']))
+            return
+
+        # Lookups are shared across shards, bugs are read a batch at a time
+        bz = BugzillaAPI(shared_lookups=True)
+        start = time.time()
+        saved_count = 0
+        with import_run('replay_bugs'):
+            for shard in manifest['shards']:
+                saved_count += bz.save_bugs(iter_shard(directory, shard), update_existing=options['update_existing'])
+                self.stderr.write("%s: %d bugs" % (shard['file'], shard['count']))
+        total = time.time() - start
+        self.stdout.write("Saved %d of %d bugs in %.2fs (%.1f bugs/sec)" % (
+            saved_count, manifest['bug_count'], total, manifest['bug_count'] / total if total else 0))
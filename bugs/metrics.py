@@ -0,0 +1,181 @@
+"""
+Counters and timers of the import path (HTTP requests, bytes downloaded, DB queries
+and time per stage, bugs saved), kept per process in `metrics`.
+
+Celery workers don't share memory with the web process, so each import task also
+records what it did as an ImportRun row (see `import_run`), which the `/metrics`
+endpoint exposes along with the metrics of the web process itself.
+"""
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _format_key(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % label for label in labels))
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of counters and timers, each identified by a name and labels:
+
+        metrics.incr('http_requests', status=200)
+        with metrics.timer('stage', stage='users'):
+            ...
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        # (name, labels) -> [count, total seconds]
+        self.timers = collections.defaultdict(lambda: [0, 0.0])
+
+    def incr(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self.timers[key]
+            timer[0] += 1
+            timer[1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time the block into timer `name`, and count the DB queries it makes
+        into counter `<name>_queries` (see `count_queries`).
+        """
+        start = time.time()
+        with count_queries() as queries:
+            yield
+        self.observe(name, time.time() - start, **labels)
+        if settings.BUGZILLA_METRICS_COUNT_QUERIES:
+            self.incr(name + '_queries', queries[0], **labels)
+
+    def snapshot(self):
+        """
+        Flat dict of metric key (`name{label="value"}`) -> value, timers giving a
+        `<name>_count` and a `<name>_sum` each, e.g. to diff or store as JSON.
+        """
+        with self._lock:
+            values = {_format_key(name, labels): value for (name, labels), value in self.counters.items()}
+            for (name, labels), (count, total) in self.timers.items():
+                values[_format_key(name + '_count', labels)] = count
+                values[_format_key(name + '_sum', labels)] = total
+        return values
+
+    def to_prometheus(self, prefix='bugzilla_'):
+        """
+        The metrics in Prometheus text exposition format, counters as counters
+        and timers as summaries (count and sum).
+        """
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append('# TYPE %s%s_total counter' % (prefix, name))
+                last_name = name
+            lines.append('%s %r' % (_format_key(prefix + name + '_total', labels), float(value)))
+        for (name, labels), (count, total) in timers:
+            if name != last_name:
+                lines.append('# TYPE %s%s_seconds summary' % (prefix, name))
+                last_name = name
+            lines.append('%s %d' % (_format_key(prefix + name + '_seconds_count', labels), count))
+            lines.append('%s %r' % (_format_key(prefix + name + '_seconds_sum', labels), total))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+# Process-wide
+metrics = Metrics()
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the DB queries made by the block on this thread's connection, into the
+    first item of the list yielded, when `settings.BUGZILLA_METRICS_COUNT_QUERIES`.
+
+    Queries are counted off the connection's query log. When nothing logs queries
+    already, the outermost block empties and turns on the log for its duration (as
+    `DEBUG` would), and empties it again at its end, so the SQL logged is only held
+    while it runs. When something does (`DEBUG`, CaptureQueriesContext, assertNumQueries)
+    the log is left alone. Django 1.11 has no execute wrappers to count with instead.
+    The log keeps the latest 9000 queries only, so blocks undercount once it is full.
+    """
+    queries = [0]
+    if not settings.BUGZILLA_METRICS_COUNT_QUERIES:
+        yield queries
+        return
+    depth = getattr(_local, 'depth', 0)
+    if not depth:
+        _local.switched_on = not connection.queries_logged
+        if _local.switched_on:
+            connection.force_debug_cursor = True
+            connection.queries_log.clear()
+    _local.depth = depth + 1
+    start = len(connection.queries_log)
+    try:
+        yield queries
+    finally:
+        queries[0] = len(connection.queries_log) - start
+        _local.depth = depth
+        if not depth and _local.switched_on:
+            connection.force_debug_cursor = False
+            connection.queries_log.clear()
+
+
+@contextmanager
+def import_run(name):
+    """
+    Record what the block did to the metrics of this process as an ImportRun named `name`,
+    and log a summary of it:
+
+        with import_run('sync_bugzilla_bugs'):
+            ...
+    """
+    from bugs.models import ImportRun
+
+    before = metrics.snapshot()
+    run = ImportRun(name=name, started_at=timezone.now())
+    start = time.time()
+    try:
+        yield run
+    finally:
+        after = metrics.snapshot()
+        run.stats = {key: value - before.get(key, 0) for key, value in after.items()
+                     if value != before.get(key, 0)}
+        run.seconds = time.time() - start
+        run.finished_at = timezone.now()
+        run.bugs_saved = int(run.stats.get('bugs_saved', 0))
+        run.http_requests = int(sum(value for key, value in run.stats.items() if key.startswith('http_requests{')))
+        run.http_bytes = int(run.stats.get('http_bytes', 0))
+        run.db_queries = int(sum(value for key, value in run.stats.items() if key.startswith('stage_queries{')))
+        run.save()
+        logger.info("%s: %d bugs saved in %.1fs (%.1f bugs/sec), %d HTTP requests (%d bytes), %d DB queries",
+                    name, run.bugs_saved, run.seconds, run.bugs_per_sec, run.http_requests,
+                    run.http_bytes, run.db_queries)
+        for key in sorted(run.stats):
+            logger.debug("%s: %s = %s", name, key, run.stats[key])
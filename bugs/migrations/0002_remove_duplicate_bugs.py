@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:10
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def remove_duplicate_bugs(apps, schema_editor):
+    """
+    Concurrent imports could save the same bug twice before bz_id was unique,
+    keep only the latest row of each bz_id.
+    """
+    Bug = apps.get_model('bugs', 'Bug')
+    duplicated = Bug.objects.values('bz_id').annotate(count=Count('id')).filter(count__gt=1)
+    for bz_id in duplicated.values_list('bz_id', flat=True):
+        pks = list(Bug.objects.filter(bz_id=bz_id).order_by('-id').values_list('id', flat=True))
+        Bug.objects.filter(id__in=pks[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_bugs, migrations.RunPython.noop),
+    ]
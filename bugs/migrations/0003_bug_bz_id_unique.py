@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0002_remove_duplicate_bugs'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bug',
+            name='bz_id',
+            field=models.IntegerField(unique=True),
+        ),
+    ]
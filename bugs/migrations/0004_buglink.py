@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0003_bug_bz_id_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BugLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('blocks', 'Blocks'), ('depends_on', 'Depends on'), ('dupe_of', 'Duplicate of'), ('see_also', 'See also')], max_length=20)),
+                ('from_bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='links', to='bugs.Bug')),
+                ('to_bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='backlinks', to='bugs.Bug')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='buglink',
+            unique_together=set([('from_bug', 'to_bug', 'kind')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:14
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0004_buglink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bz_id', models.IntegerField(unique=True)),
+                ('creation_time', models.DateTimeField()),
+                ('last_change_time', models.DateTimeField(blank=True, null=True)),
+                ('file_name', models.CharField(max_length=255)),
+                ('summary', models.TextField(blank=True)),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('size', models.IntegerField(default=0)),
+                ('is_patch', models.BooleanField(default=False)),
+                ('is_obsolete', models.BooleanField(default=False)),
+                ('is_private', models.BooleanField(default=False)),
+                ('data', models.FileField(blank=True, max_length=512, upload_to='attachments')),
+                ('bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='bugs.Bug')),
+                ('creator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Comment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bz_id', models.IntegerField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('creation_time', models.DateTimeField()),
+                ('is_private', models.BooleanField(default=False)),
+                ('attachment_id', models.IntegerField(blank=True, null=True)),
+                ('text', models.TextField(blank=True)),
+                ('bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='bugs.Bug')),
+                ('creator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:22
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0006_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('seconds', models.FloatField()),
+                ('bugs_saved', models.IntegerField(default=0)),
+                ('http_requests', models.IntegerField(default=0)),
+                ('http_bytes', models.BigIntegerField(default=0)),
+                ('db_queries', models.IntegerField(default=0)),
+                ('stats', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0007_importrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BugCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_open', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Component')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Product')),
+                ('severity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Severity')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Status')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BugCountSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_open', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+                ('date', models.DateField(db_index=True)),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Component')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Product')),
+                ('severity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Severity')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bugs.Status')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='bugcountsnapshot',
+            unique_together=set([('date', 'product', 'component', 'severity', 'status', 'is_open')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bugcount',
+            unique_together=set([('product', 'component', 'severity', 'status', 'is_open')]),
+        ),
+        # Counts of the bugs already imported, kept up to date by the importer from now on
+        migrations.RunSQL(
+            'INSERT INTO bugs_bugcount (product_id, component_id, severity_id, status_id, is_open, count)'
+            ' SELECT product_id, component_id, severity_id, status_id, is_open, count(*)'
+            ' FROM bugs_bug GROUP BY product_id, component_id, severity_id, status_id, is_open',
+            migrations.RunSQL.noop,
+        ),
+    ]
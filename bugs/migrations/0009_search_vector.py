@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:27
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# Keep in step with bugs.models.SEARCH_CONFIG
+BUG_SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce({row}.summary, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce({row}.whiteboard, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce({row}.resolution, '')), 'D')
+"""
+COMMENT_SEARCH_VECTOR = "to_tsvector('english', coalesce({row}.text, ''))"
+
+TRIGGER_SQL = """
+CREATE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {vector};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE OF {columns} ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector_update();
+
+UPDATE {table} SET search_vector = {backfill_vector};
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER {table}_search_vector_update ON {table};
+DROP FUNCTION {table}_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0008_bugcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bug',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Computed by the database on every write, whichever way the rows are written (ORM, upsert, COPY)
+        migrations.RunSQL(
+            TRIGGER_SQL.format(table='bugs_bug', columns='summary, whiteboard, resolution',
+                               vector=BUG_SEARCH_VECTOR.format(row='NEW'),
+                               backfill_vector=BUG_SEARCH_VECTOR.format(row='bugs_bug')),
+            DROP_TRIGGER_SQL.format(table='bugs_bug'),
+        ),
+        migrations.RunSQL(
+            TRIGGER_SQL.format(table='bugs_comment', columns='text',
+                               vector=COMMENT_SEARCH_VECTOR.format(row='NEW'),
+                               backfill_vector=COMMENT_SEARCH_VECTOR.format(row='bugs_comment')),
+            DROP_TRIGGER_SQL.format(table='bugs_comment'),
+        ),
+        migrations.AddIndex(
+            model_name='bug',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='bugs_bug_search__89b405_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='bugs_commen_search__7b5873_gin'),
+        ),
+        # Trigram indexes for substring (ILIKE '%...%') searches, see `BugQuerySet.contains`
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX bugs_bug_summary_trgm ON bugs_bug USING gin (summary gin_trgm_ops);'
+            'CREATE INDEX bugs_bug_whiteboard_trgm ON bugs_bug USING gin (whiteboard gin_trgm_ops);'
+            'CREATE INDEX bugs_comment_text_trgm ON bugs_comment USING gin (text gin_trgm_ops);',
+            'DROP INDEX bugs_bug_summary_trgm;'
+            'DROP INDEX bugs_bug_whiteboard_trgm;'
+            'DROP INDEX bugs_comment_text_trgm;',
+        ),
+    ]
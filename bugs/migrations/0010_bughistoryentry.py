@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:29
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0009_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BugHistoryEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('when', models.DateTimeField()),
+                ('field_name', models.CharField(max_length=64)),
+                ('removed', models.TextField(blank=True)),
+                ('added', models.TextField(blank=True)),
+                ('attachment_id', models.IntegerField(blank=True, null=True)),
+                ('bug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='bugs.Bug')),
+                ('who', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bug_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'bug history entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='bughistoryentry',
+            index=models.Index(fields=['bug', 'when'], name='bugs_bughis_bug_id_a45687_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bughistoryentry',
+            index=models.Index(fields=['field_name', 'when'], name='bugs_bughis_field_n_816c1f_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:31
+from __future__ import unicode_literals
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0010_bughistoryentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bug',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['blocks'], name='bugs_bug_blocks_356773_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='bug',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['depends_on'], name='bugs_bug_depends_9fcb6a_gin'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Components used to be looked up by name alone, leaving `product` empty and sharing one
+# row between the same named components of several products (e.g. "General"). Give each
+# (product, name) its own row, with the product of the bugs pointing at it.
+REPOINT_SQL = (
+    'UPDATE {table} t SET component_id = new.id'
+    ' FROM bugs_component old, bugs_product p, bugs_component new'
+    " WHERE old.id = t.component_id AND old.product = '' AND p.id = t.product_id"
+    ' AND new.product = p.name AND new.name = old.name;'
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0011_bug_dependency_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='component',
+            name='name',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.RunSQL(
+            'INSERT INTO bugs_component (name, product)'
+            ' SELECT DISTINCT c.name, p.name FROM bugs_bug b'
+            ' JOIN bugs_component c ON c.id = b.component_id JOIN bugs_product p ON p.id = b.product_id'
+            " WHERE c.product = '' ON CONFLICT DO NOTHING;" +
+            REPOINT_SQL.format(table='bugs_bug') +
+            REPOINT_SQL.format(table='bugs_bugcount') +
+            REPOINT_SQL.format(table='bugs_bugcountsnapshot') +
+            "DELETE FROM bugs_component c WHERE c.product = ''"
+            ' AND NOT EXISTS (SELECT 1 FROM bugs_bug WHERE component_id = c.id)'
+            ' AND NOT EXISTS (SELECT 1 FROM bugs_bugcount WHERE component_id = c.id)'
+            ' AND NOT EXISTS (SELECT 1 FROM bugs_bugcountsnapshot WHERE component_id = c.id);',
+            migrations.RunSQL.noop,
+        ),
+    ]
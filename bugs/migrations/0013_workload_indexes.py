@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-18 14:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bugs', '0012_component_natural_key'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bug',
+            index=models.Index(fields=['last_change_time'], name='bug_last_change_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bug',
+            index=models.Index(fields=['creation_time'], name='bug_creation_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bug',
+            index=models.Index(fields=['product', 'component', 'status'], name='bug_prod_comp_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['bug', 'creation_time'], name='comment_bug_creation_time_idx'),
+        ),
+        # Open bugs are a small part of all bugs, and what the importer's default search,
+        # the dashboards and release managers mostly read: a partial index only holds them
+        migrations.RunSQL(
+            'CREATE INDEX bug_open_prod_comp_idx ON bugs_bug (product_id, component_id) WHERE is_open;',
+            'DROP INDEX bug_open_prod_comp_idx;',
+        ),
+    ]
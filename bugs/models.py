@@ -2,10 +2,17 @@ from __future__ import unicode_literals
 
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
 from django.conf import settings
 from django.core.mail import send_mail
-from django.db import models
+from django.db import connection, models
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from psycopg2.extras import execute_values
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -56,16 +63,15 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def get_full_name(self):
         '''
-        Returns the first_name plus the last_name, with a space in between.
+        Returns the name of the user (the real name on Bugzilla).
         '''
-        full_name = '%s %s' % (self.first_name, self.last_name)
-        return full_name.strip()
+        return self.name.strip()
 
     def get_short_name(self):
         '''
         Returns the short name for the user.
         '''
-        return self.first_name
+        return self.name
 
     def email_user(self, subject, message, from_email=None, **kwargs):
         '''
@@ -76,6 +82,8 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 class SingleFieldModelBase(models.Model):
     name = models.CharField(max_length=200, unique=True)
+    # Fields identifying a row, what `lookups.LookupCache` keys it by
+    NATURAL_KEY = ('name', )
 
     class Meta:
         abstract = True
@@ -89,7 +97,10 @@ class Classification(SingleFieldModelBase):
 
 
 class Component(SingleFieldModelBase):
+    # Component names are only unique within their product
+    name = models.CharField(max_length=200)
     product = models.CharField(max_length=200)
+    NATURAL_KEY = ('product', 'name')
 
     class Meta:
         unique_together = (('product', 'name'), )
@@ -135,8 +146,105 @@ class TargetMilestone(SingleFieldModelBase):
     pass
 
 
+# Text search configuration of the search_vector columns, set by the triggers of migration 0009
+SEARCH_CONFIG = 'english'
+
+
+class BugQuerySet(models.QuerySet):
+
+    def _matching(self, bug_condition, comment_condition, params):
+        # One UNION of two index scans: OR-ing the bug and comment conditions in the
+        # WHERE clause would make Postgres scan the whole bugs table instead
+        return self.filter(pk__in=RawSQL(
+            'SELECT id FROM {bug_table} WHERE {bug_condition}'
+            ' UNION SELECT bug_id FROM {comment_table} WHERE {comment_condition}'.format(
+                bug_table=connection.ops.quote_name(Bug._meta.db_table),
+                comment_table=connection.ops.quote_name(Comment._meta.db_table),
+                bug_condition=bug_condition,
+                comment_condition=comment_condition,
+            ), params))
+
+    def search(self, text):
+        """
+        Full-text search of `text` (words, stemmed) in the summary, whiteboard and
+        resolution of bugs and in their comments, through the GIN indexed search_vector
+        columns. Bugs are annotated with the `rank` of their own text and ordered by it,
+        best first (bugs only matching through comments come last).
+        """
+        condition = 'search_vector @@ plainto_tsquery(%s::regconfig, %s)'
+        query = SearchQuery(text, config=SEARCH_CONFIG)
+        return self._matching(condition, condition, [SEARCH_CONFIG, text, SEARCH_CONFIG, text]).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', 'bz_id')
+
+    def contains(self, fragment):
+        """
+        Substring search of `fragment` (e.g. a stack trace line), case insensitive, in the
+        summary and whiteboard of bugs and in their comments, through the trigram indexes.
+        Bugs are annotated with `similarity` of their summary or whiteboard and ordered by it.
+        """
+        pattern = '%{}%'.format(fragment.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+        return self._matching('summary ILIKE %s OR whiteboard ILIKE %s', 'text ILIKE %s',
+                              [pattern, pattern, pattern]).annotate(
+            similarity=Greatest(TrigramSimilarity('summary', fragment), TrigramSimilarity('whiteboard', fragment))
+        ).order_by('-similarity', 'bz_id')
+
+    def blocking(self, bz_id):
+        """
+        The bugs given bug transitively depends on, e.g. everything holding up a release
+        tracker bug, from the in-memory `graph.DependencyGraph`.
+        """
+        from bugs.graph import get_graph
+        return self.filter(bz_id__in=get_graph().closure([bz_id], BugLink.DEPENDS_ON))
+
+    def blocked_by(self, bz_id):
+        """
+        The bugs given bug transitively blocks, from the in-memory `graph.DependencyGraph`.
+        """
+        from bugs.graph import get_graph
+        return self.filter(bz_id__in=get_graph().closure([bz_id], BugLink.BLOCKS))
+
+
+class BugManager(models.Manager.from_queryset(BugQuerySet)):
+
+    def upsert(self, bugs, update_existing=False):
+        """
+        Write given (unsaved) Bug instances with a single
+        `INSERT ... ON CONFLICT (bz_id)` statement.
+
+        Bugs whose bz_id already exists are left alone, or with `update_existing`
+        overwritten if their `last_change_time` differs from the saved one.
+        Returns list of (pk, bz_id, inserted) tuples for the rows actually
+        inserted or updated, `inserted` being False for updated rows.
+        """
+        if not bugs:
+            return []
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        qn = connection.ops.quote_name
+        columns = [qn(field.column) for field in fields]
+        table = qn(self.model._meta.db_table)
+        if update_existing:
+            conflict_action = 'DO UPDATE SET {} WHERE {}.last_change_time IS DISTINCT FROM EXCLUDED.last_change_time'.format(
+                ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in columns if column != qn('bz_id')),
+                table,
+            )
+        else:
+            conflict_action = 'DO NOTHING'
+        # xmax is 0 only for rows inserted (not updated) by this statement
+        sql = 'INSERT INTO {} ({}) VALUES %s ON CONFLICT (bz_id) {} RETURNING id, bz_id, (xmax = 0)'.format(
+            table, ', '.join(columns), conflict_action)
+        rows = [
+            tuple(field.get_db_prep_save(getattr(bug, field.attname), connection) for field in fields)
+            for bug in bugs
+        ]
+        with connection.cursor() as cursor:
+            # A single page, so that fetchall() returns the rows of the whole statement
+            execute_values(cursor.cursor, sql, rows, page_size=len(rows))
+            return cursor.fetchall()
+
+
 class Bug(models.Model):
-    bz_id = models.IntegerField(db_index=True)
+    bz_id = models.IntegerField(unique=True)
     alias = models.CharField(max_length=50)
     assigned_to = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='assigned_bugs')
 
@@ -161,6 +269,9 @@ class Bug(models.Model):
     is_open = models.BooleanField(default=False)
     keywords = models.ManyToManyField(Keyword, blank=True)
     last_change_time = models.DateTimeField(null=True, blank=True)
+    # When the bug was last written by an import (set on the instance, as the upsert and
+    # COPY paths don't call pre_save), unlike `last_change_time` which is Bugzilla's
+    imported_at = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
     op_sys = models.ForeignKey(OpSys, null=True, blank=True)
     platform = models.ForeignKey(Platform, null=True, blank=True)
     priority = models.ForeignKey(Priority, null=True, blank=True)
@@ -176,6 +287,215 @@ class Bug(models.Model):
     url = models.URLField(max_length=512, null=True, blank=True)
     version = models.CharField(max_length=100, null=True, blank=True)
     whiteboard = models.TextField(blank=True)
+    # Weighted summary, whiteboard and resolution, maintained by a trigger (see `BugQuerySet.search`)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BugManager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            # For `blocks__contains=[<bz id>]` / `depends_on__overlap=[...]` lookups
+            GinIndex(fields=['blocks']),
+            GinIndex(fields=['depends_on']),
+            # Sync watermark and changed since, see `BugzillaAPI.sync_bugs` and `graph.DependencyGraph`
+            models.Index(fields=['last_change_time'], name='bug_last_change_time_idx'),
+            models.Index(fields=['creation_time'], name='bug_creation_time_idx'),
+            # Reports filtering on these together, see also the partial index of
+            # open bugs in migration 0013
+            models.Index(fields=['product', 'component', 'status'], name='bug_prod_comp_status_idx'),
+        ]
 
     def __str__(self):
         return str(self.bz_id)
+
+
+class BugLink(models.Model):
+    """
+    Bug to Bug relation, materialized from the bz ids stored in
+    `Bug.blocks`, `Bug.depends_on`, `Bug.dupe_of` and `Bug.see_also`
+    once both bugs are saved (see `bugs.links.BugLinkResolver`).
+    """
+    BLOCKS = 'blocks'
+    DEPENDS_ON = 'depends_on'
+    DUPE_OF = 'dupe_of'
+    SEE_ALSO = 'see_also'
+    KIND_CHOICES = (
+        (BLOCKS, 'Blocks'),
+        (DEPENDS_ON, 'Depends on'),
+        (DUPE_OF, 'Duplicate of'),
+        (SEE_ALSO, 'See also'),
+    )
+
+    from_bug = models.ForeignKey(Bug, related_name='links')
+    to_bug = models.ForeignKey(Bug, related_name='backlinks')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+
+    class Meta:
+        unique_together = (('from_bug', 'to_bug', 'kind'), )
+
+    def __str__(self):
+        return '%s %s %s' % (self.from_bug_id, self.kind, self.to_bug_id)
+
+
+class Comment(models.Model):
+    bz_id = models.IntegerField(unique=True)
+    bug = models.ForeignKey(Bug, related_name='comments')
+    # Position of the comment in the bug, 0 being the description
+    count = models.IntegerField(default=0)
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='comments')
+    creation_time = models.DateTimeField()
+    is_private = models.BooleanField(default=False)
+    # bz id of the attachment this comment was made for, if any
+    attachment_id = models.IntegerField(null=True, blank=True)
+    text = models.TextField(blank=True)
+    # Text, maintained by a trigger (see `BugQuerySet.search`)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            # Latest comment of bugs, see `comments.CommentImporter`
+            models.Index(fields=['bug', 'creation_time'], name='comment_bug_creation_time_idx'),
+        ]
+
+    def __str__(self):
+        return '%s#c%s' % (self.bug_id, self.count)
+
+
+class Attachment(models.Model):
+    bz_id = models.IntegerField(unique=True)
+    bug = models.ForeignKey(Bug, related_name='attachments')
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='attachments')
+    creation_time = models.DateTimeField()
+    last_change_time = models.DateTimeField(null=True, blank=True)
+    file_name = models.CharField(max_length=255)
+    summary = models.TextField(blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    size = models.IntegerField(default=0)
+    is_patch = models.BooleanField(default=False)
+    is_obsolete = models.BooleanField(default=False)
+    is_private = models.BooleanField(default=False)
+    # Empty until the content is downloaded, see bugs.attachments.AttachmentImporter
+    data = models.FileField(upload_to='attachments', max_length=512, blank=True)
+
+    def __str__(self):
+        return self.file_name
+
+
+class BugHistoryEntry(models.Model):
+    """
+    One field change of a bug, from the Bugzilla bug history API. Append-only: entries are
+    only ever added after the latest one saved for their bug, see `history.HistoryImporter`.
+    """
+    bug = models.ForeignKey(Bug, related_name='history')
+    when = models.DateTimeField()
+    who = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='bug_changes')
+    field_name = models.CharField(max_length=64)
+    removed = models.TextField(blank=True)
+    added = models.TextField(blank=True)
+    # bz id of the attachment whose field changed, if any
+    attachment_id = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'bug history entries'
+        indexes = [
+            # The history of a bug, and its latest change seen
+            models.Index(fields=['bug', 'when']),
+            # e.g. when bugs moved to a status, for time in state
+            models.Index(fields=['field_name', 'when']),
+        ]
+
+    def __str__(self):
+        return '%s %s at %s' % (self.bug_id, self.field_name, self.when)
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of a (possibly interrupted) import, updated in the same transaction as
+    each page of bugs it saves, see `BugzillaAPI.import_bugs`.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    # Highest bug id saved so far, the import resumes after it
+    last_bz_id = models.IntegerField(null=True, blank=True)
+    # `last_change_time` the import fetches changes since, for incremental syncs
+    watermark = models.DateTimeField(null=True, blank=True)
+    pages_count = models.IntegerField(default=0)
+    saved_count = models.IntegerField(default=0)
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ImportRun(models.Model):
+    """
+    What one import task did, from the metrics of the process that ran it, see `bugs.metrics.import_run`.
+    """
+    name = models.CharField(max_length=100, db_index=True)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    seconds = models.FloatField()
+    bugs_saved = models.IntegerField(default=0)
+    http_requests = models.IntegerField(default=0)
+    http_bytes = models.BigIntegerField(default=0)
+    db_queries = models.IntegerField(default=0)
+    # Every counter and timer that changed during the run, see `Metrics.snapshot`
+    stats = JSONField(default=dict)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return '%s at %s' % (self.name, self.started_at)
+
+    @property
+    def bugs_per_sec(self):
+        return self.bugs_saved / self.seconds if self.seconds else 0
+
+
+class BugCountBase(models.Model):
+    """
+    Number of bugs per product, component, severity, status and open-ness.
+    """
+    product = models.ForeignKey(Product, related_name='+')
+    component = models.ForeignKey(Component, related_name='+')
+    severity = models.ForeignKey(Severity, related_name='+')
+    status = models.ForeignKey(Status, related_name='+')
+    is_open = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    # Bug fields the bugs are counted by, in the order of `bugs.rollups` group tuples
+    GROUP_FIELDS = ('product_id', 'component_id', 'severity_id', 'status_id', 'is_open')
+
+    class Meta:
+        abstract = True
+
+
+class BugCount(BugCountBase):
+    """
+    Current bug counts, kept up to date by the importer as it saves bugs (see `bugs.rollups`).
+    """
+
+    class Meta:
+        unique_together = (('product', 'component', 'severity', 'status', 'is_open'), )
+
+    def __str__(self):
+        return '%s/%s/%s/%s: %d' % (self.product_id, self.component_id, self.severity_id, self.status_id,
+                                    self.count)
+
+
+class BugCountSnapshot(BugCountBase):
+    """
+    Copy of the BugCount rows as of the end of `date`, for trend lines.
+    """
+    date = models.DateField(db_index=True)
+
+    class Meta:
+        unique_together = (('date', 'product', 'component', 'severity', 'status', 'is_open'), )
+
+    def __str__(self):
+        return '%s %s/%s/%s/%s: %d' % (self.date, self.product_id, self.component_id, self.severity_id,
+                                       self.status_id, self.count)
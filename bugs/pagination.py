@@ -0,0 +1,38 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class BugCursorPagination(CursorPagination):
+    """
+    Keyset pagination: each page is fetched with `WHERE <ordering field> > <cursor>`
+    off the index instead of an OFFSET, so deep pages cost the same as the first,
+    and there is no COUNT query. Ordering can be switched with `?ordering=`
+    to `last_change_time` (e.g. to follow changes) or their descending versions.
+    """
+    ordering = 'bz_id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator of querysets that takes the number of rows from the Postgres planner's estimate
+    (EXPLAIN, off the table statistics) instead of a `COUNT(*)` scanning all of them, when
+    it is over `EXACT_COUNT_LIMIT`. Page links of big tables are then only about right.
+    """
+    EXACT_COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        sql, params = query.sql_with_params()
+        with connections[self.object_list.db].cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate > self.EXACT_COUNT_LIMIT:
+            return estimate
+        return super(EstimatedCountPaginator, self).count
@@ -0,0 +1,144 @@
+"""
+Maintains the BugCount rollup (bugs per product, component, severity, status and
+open-ness) incrementally as bugs are saved, and its daily BugCountSnapshot copies,
+so dashboards read a few hundred rows instead of grouping all of `bugs_bug`.
+"""
+import collections
+
+from django.db import connection, transaction
+from django.utils import timezone
+from psycopg2.extras import execute_values
+
+from bugs import models
+
+qn = connection.ops.quote_name
+
+# Dimensions the counts can be read by -> their lookup from BugCount/BugCountSnapshot
+DIMENSIONS = {
+    'product': 'product__name',
+    'component': 'component__name',
+    'severity': 'severity__name',
+    'status': 'status__name',
+    'is_open': 'is_open',
+}
+
+
+def _group_columns():
+    return [qn(models.BugCount._meta.get_field(field).column) for field in models.BugCount.GROUP_FIELDS]
+
+
+def get_bug_group(bug):
+    """
+    The BugCount group of given Bug instance, as tuple of `BugCount.GROUP_FIELDS` values.
+    """
+    return tuple(getattr(bug, field) for field in models.BugCount.GROUP_FIELDS)
+
+
+def get_saved_groups(bz_ids):
+    """
+    Return dict of bz_id -> BugCount group of the given saved bugs, locking their rows
+    until the end of the transaction, so they can't change under the counts computed from them.
+    Must be called inside a transaction.
+    """
+    return {
+        row[0]: tuple(row[1:])
+        for row in models.Bug.objects.select_for_update().filter(bz_id__in=bz_ids).values_list(
+            'bz_id', *models.BugCount.GROUP_FIELDS)
+    }
+
+
+def apply_deltas(deltas):
+    """
+    Add given dict of BugCount group -> count change to the BugCount rows,
+    creating the missing ones, with one INSERT ... ON CONFLICT statement.
+    """
+    rows = [group + (delta, ) for group, delta in deltas.items() if delta]
+    if not rows:
+        return
+    sql = (
+        'INSERT INTO {table} ({columns}, count) VALUES %s '
+        'ON CONFLICT ({columns}) DO UPDATE SET count = {table}.count + EXCLUDED.count'
+    ).format(table=qn(models.BugCount._meta.db_table), columns=', '.join(_group_columns()))
+    with connection.cursor() as cursor:
+        # Sorted, so that concurrent imports lock the rollup rows in the same order
+        execute_values(cursor.cursor, sql, sorted(rows))
+
+
+def count_saved_bugs(inserted, updated, old_groups):
+    """
+    Update the BugCount rows for a batch of bugs just written: +1 in the group of each of the
+    `inserted` Bug instances, and for each of the `updated` ones -1 in its group in `old_groups`
+    (from `get_saved_groups` before the write) and +1 in its current one.
+    """
+    deltas = collections.Counter()
+    for bug in inserted:
+        deltas[get_bug_group(bug)] += 1
+    for bug in updated:
+        # Missing if another import inserted the bug since `get_saved_groups`,
+        # the counts are then off by one until the next `rebuild`
+        if bug.bz_id in old_groups:
+            deltas[old_groups[bug.bz_id]] -= 1
+        deltas[get_bug_group(bug)] += 1
+    apply_deltas(deltas)
+
+
+def count_bugs_in_table(table, id_column='id'):
+    """
+    Add the bugs whose pk is in `id_column` of given table (e.g. the bugs just loaded
+    by `copy_loader.CopyLoader`) to the BugCount rows, with one INSERT ... SELECT.
+    """
+    columns = _group_columns()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT INTO {rollup_table} ({columns}, count)'
+            ' SELECT {bug_columns}, count(*) FROM {bug_table} bug'
+            ' JOIN {table} loaded ON loaded.{id_column} = bug.id'
+            ' GROUP BY {bug_columns} ORDER BY {bug_columns}'
+            ' ON CONFLICT ({columns}) DO UPDATE SET count = {rollup_table}.count + EXCLUDED.count'.format(
+                rollup_table=qn(models.BugCount._meta.db_table),
+                columns=', '.join(columns),
+                bug_columns=', '.join('bug.%s' % column for column in columns),
+                bug_table=qn(models.Bug._meta.db_table),
+                table=qn(table),
+                id_column=qn(id_column),
+            ))
+
+
+def rebuild():
+    """
+    Recompute all BugCount rows from scratch, e.g. after bugs were changed behind the importer's back.
+    Returns the number of rows.
+    """
+    columns = ', '.join(_group_columns())
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Blocks the incremental updates until done, rather than racing them
+        cursor.execute('LOCK TABLE {} IN EXCLUSIVE MODE'.format(qn(models.BugCount._meta.db_table)))
+        cursor.execute('DELETE FROM {}'.format(qn(models.BugCount._meta.db_table)))
+        cursor.execute(
+            'INSERT INTO {rollup_table} ({columns}, count)'
+            ' SELECT {columns}, count(*) FROM {bug_table} GROUP BY {columns}'.format(
+                rollup_table=qn(models.BugCount._meta.db_table),
+                columns=columns,
+                bug_table=qn(models.Bug._meta.db_table),
+            ))
+        return cursor.rowcount
+
+
+def take_snapshot(date=None):
+    """
+    Copy the current BugCount rows as the BugCountSnapshot of `date` (default today),
+    replacing any previous snapshot of that date. Returns the number of rows.
+    """
+    date = date or timezone.localdate()
+    columns = ', '.join(_group_columns())
+    with transaction.atomic():
+        models.BugCountSnapshot.objects.filter(date=date).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {snapshot_table} (date, {columns}, count)'
+                ' SELECT %s, {columns}, count FROM {rollup_table} WHERE count != 0'.format(
+                    snapshot_table=qn(models.BugCountSnapshot._meta.db_table),
+                    columns=columns,
+                    rollup_table=qn(models.BugCount._meta.db_table),
+                ), [date])
+            return cursor.rowcount
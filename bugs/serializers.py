@@ -0,0 +1,51 @@
+from rest_framework import serializers
+
+from bugs import models
+
+
+class SparseFieldsMixin(object):
+    """
+    Serializer only serializing the fields listed in the `fields` query parameter
+    (comma separated) of the request in its context, all fields without it.
+    """
+
+    @staticmethod
+    def get_requested_fields(request):
+        fields = request.query_params.get('fields') if request is not None else None
+        if not fields:
+            return None
+        return set(field.strip() for field in fields.split(',') if field.strip())
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get('request'))
+        if requested is not None:
+            for field_name in set(self.fields) - requested:
+                self.fields.pop(field_name)
+
+
+class BugSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Bugs with their lookups as names and users as emails, the way Bugzilla shows them.
+    """
+    assigned_to = serializers.SlugRelatedField(slug_field='email', read_only=True)
+    classification = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    component = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    creator = serializers.SlugRelatedField(slug_field='email', read_only=True)
+    op_sys = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    platform = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    priority = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    product = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    qa_contact = serializers.SlugRelatedField(slug_field='email', read_only=True)
+    severity = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    status = serializers.SlugRelatedField(slug_field='name', read_only=True)
+    target_milestone = serializers.SlugRelatedField(slug_field='name', read_only=True)
+
+    cc = serializers.SlugRelatedField(slug_field='email', many=True, read_only=True)
+    flags = serializers.SlugRelatedField(slug_field='name', many=True, read_only=True)
+    groups = serializers.SlugRelatedField(slug_field='name', many=True, read_only=True)
+    keywords = serializers.SlugRelatedField(slug_field='name', many=True, read_only=True)
+
+    class Meta:
+        model = models.Bug
+        exclude = ('id', )
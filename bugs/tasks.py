@@ -1,25 +1,234 @@
-import json
+import logging
 
+from celery import chord
 from celery.schedules import crontab
 from celery.decorators import periodic_task
+from django.conf import settings
 from bugzilla.celery import app
 
-from third_party.bugzilla import BugzillaAPI
+from attachments import AttachmentImporter
+from comments import CommentImporter
+from dumps import iter_shard
+from history import HistoryImporter
+from links import BugLinkResolver
+from metrics import import_run
+from models import Bug
+from rollups import take_snapshot
+from third_party.bugzilla import BugzillaAPI, BugzillaAPIError
+from third_party.jsonstream import iter_file_chunks, iter_json_array
 
-# @periodic_task(run_every=crontab(minute=0, hour=0))
+logger = logging.getLogger(__name__)
 
 
 @app.task()
-def fetch_bugzilla_bugs():
+def fetch_bugzilla_bugs(path=None, page_size=None):
+    """
+    Fetch bugs from Bugzilla page by page, saving each page as it arrives.
+    If `path` is given, bugs are instead read from that Bugzilla bugs API JSON dump
+    (e.g. `/tmp/bugs.json`).
+    """
     bz = BugzillaAPI()
-    # success, bugs_or_error = bz.fetch_bugs()
-    success = True
-    with open("/tmp/bugs.json") as f:
-        bugs_or_error = json.load(f)['bugs']
-    if success:
-        save_count = bz.save_bugs(bugs_or_error)
-        print("Saved %d bugs" % save_count)
-    else:
-        print bugs_or_error
-    # TODO -
-    # paginated fetching using limit and offset
+    if path:
+        # Bugs are decoded as the file is read, and saved a batch at a time
+        with open(path, 'rb') as f, import_run('fetch_bugzilla_bugs'):
+            save_count = bz.save_bugs(iter_json_array(iter_file_chunks(f), 'bugs'))
+        logger.info("Saved %d bugs", save_count)
+        return save_count
+
+    # Picks up after the last page saved if a previous run got interrupted
+    checkpoint = bz.get_checkpoint('full')
+    with import_run('fetch_bugzilla_bugs'):
+        try:
+            bz.import_bugs(checkpoint, page_size=page_size)
+        except BugzillaAPIError as e:
+            logger.error("%s: %s", e, e.response)
+    logger.info("Saved %d bugs", checkpoint.saved_count)
+    return checkpoint.saved_count
+
+
+@app.task()
+def import_bugzilla_bugs(chunk_size=None, update_existing=False):
+    """
+    Parallel import: splits the bug id space into ranges of `chunk_size` ids
+    (default `settings.BUGZILLA_IMPORT_CHUNK_SIZE`), imports each range in its own
+    `import_bug_id_range` task, on as many workers as are available,
+    and reports the totals from `finish_bugzilla_import` once all are done.
+    Returns the number of chunks dispatched.
+    """
+    bz = BugzillaAPI()
+    max_bug_id = bz.get_max_bug_id()
+    if not max_bug_id:
+        logger.info("No bugs to import")
+        return 0
+    chunk_size = chunk_size or settings.BUGZILLA_IMPORT_CHUNK_SIZE
+    chunks = [
+        import_bug_id_range.s(first_id, min(first_id + chunk_size - 1, max_bug_id), update_existing)
+        for first_id in range(1, max_bug_id + 1, chunk_size)
+    ]
+    chord(chunks)(finish_bugzilla_import.s())
+    logger.info("Dispatched %d chunks of up to %d bug ids", len(chunks), chunk_size)
+    return len(chunks)
+
+
+@app.task(bind=True, max_retries=3, default_retry_delay=60)
+def import_bug_id_range(self, first_id, last_id, update_existing=False):
+    """
+    Import the bugs with id between `first_id` and `last_id` (inclusive).
+    Saving is idempotent (upsert on bz_id), so it is safe to retry or
+    to run concurrently with chunks overlapping it. Retries resume
+    after the last page saved.
+    """
+    # Lookups barely change between chunks, keep them for the whole worker process
+    bz = BugzillaAPI(shared_lookups=True)
+    params = bz.get_id_range_params(first_id, last_id)
+    checkpoint = bz.get_checkpoint('bug-ids-%d-%d' % (first_id, last_id))
+    with import_run('import_bug_id_range'):
+        try:
+            bz.import_bugs(checkpoint, get_params=params, update_existing=update_existing)
+        except BugzillaAPIError as e:
+            raise self.retry(exc=e)
+    logger.info("Saved %d bugs with ids %d to %d", checkpoint.saved_count, first_id, last_id)
+    return {'first_id': first_id, 'last_id': last_id, 'saved': checkpoint.saved_count}
+
+
+@app.task()
+def finish_bugzilla_import(chunk_results):
+    """
+    Chord callback of `import_bugzilla_bugs`, gets the results of all `import_bug_id_range` tasks.
+    Once every chunk is saved, bug to bug references can be resolved across chunks.
+    """
+    total = sum(result['saved'] for result in chunk_results)
+    logger.info("Imported %d bugs in %d chunks", total, len(chunk_results))
+    resolve_bug_links.delay()
+    return {'saved': total, 'chunks': len(chunk_results)}
+
+
+@app.task()
+def replay_bug_shard(directory, shard, update_existing=False):
+    """
+    Save the bugs of given shard of the dump in `directory` (see `bugs.dumps`),
+    for `replay_bugs --parallel`. Saving is idempotent, so shards can be replayed again.
+    """
+    bz = BugzillaAPI(shared_lookups=True)
+    with import_run('replay_bug_shard'):
+        save_count = bz.save_bugs(iter_shard(directory, shard), update_existing=update_existing)
+    logger.info("Saved %d bugs of %s", save_count, shard['file'])
+    return {'file': shard['file'], 'saved': save_count}
+
+
+@app.task()
+def finish_bug_replay(shard_results):
+    """
+    Chord callback of `replay_bugs --parallel`, gets the results of all `replay_bug_shard` tasks.
+    """
+    total = sum(result['saved'] for result in shard_results)
+    logger.info("Replayed %d bugs from %d shards", total, len(shard_results))
+    return {'saved': total, 'shards': len(shard_results)}
+
+
+@app.task(bind=True, max_retries=3, default_retry_delay=60)
+def resolve_bug_links(self, bz_ids=None):
+    """
+    Turn the blocks/depends_on/dupe_of/see_also bug ids of the given bugs (all if not given)
+    into BugLink rows, fetching referenced bugs that aren't saved yet.
+    """
+    resolver = BugLinkResolver(BugzillaAPI(shared_lookups=True))
+    with import_run('resolve_bug_links'):
+        try:
+            resolver.resolve(bz_ids)
+        except BugzillaAPIError as e:
+            raise self.retry(exc=e)
+    logger.info("Linked %d bug references, fetched %d referenced bugs",
+                resolver.linked_count, resolver.fetched_count)
+    return resolver.fetched_count
+
+
+@periodic_task(run_every=crontab(minute=0, hour=0))
+def sync_bugzilla_bugs(page_size=None):
+    """
+    Nightly incremental sync: only bugs changed since the latest `last_change_time`
+    we have are fetched, new ones are created and changed ones updated.
+    A sync that got interrupted is resumed where it stopped, on the next run.
+    """
+    bz = BugzillaAPI()
+    with import_run('sync_bugzilla_bugs'):
+        try:
+            checkpoint = bz.sync_bugs(page_size=page_size)
+        except BugzillaAPIError as e:
+            logger.error("%s: %s", e, e.response)
+            return 0
+    save_count = checkpoint.saved_count
+    logger.info("Synced %d bugs", save_count)
+    if save_count:
+        changed = Bug.objects.all()
+        if checkpoint.watermark:
+            changed = changed.filter(last_change_time__gte=checkpoint.watermark)
+        changed_bz_ids = list(changed.values_list('bz_id', flat=True))
+        resolve_bug_links.delay(changed_bz_ids)
+        fetch_bug_comments.delay(changed_bz_ids)
+        fetch_bug_attachments.delay(changed_bz_ids)
+        fetch_bug_history.delay(changed_bz_ids)
+    return save_count
+
+
+@app.task(bind=True, max_retries=3, default_retry_delay=60)
+def fetch_bug_comments(self, bz_ids=None):
+    """
+    Save the comments of the given bugs (all saved bugs if not given).
+    """
+    if bz_ids is None:
+        bz_ids = Bug.objects.values_list('bz_id', flat=True)
+    importer = CommentImporter(BugzillaAPI())
+    with import_run('fetch_bug_comments'):
+        try:
+            importer.save_comments(bz_ids)
+        except BugzillaAPIError as e:
+            raise self.retry(exc=e)
+    logger.info("Saved %d comments", importer.saved_count)
+    return importer.saved_count
+
+
+@app.task(bind=True, max_retries=3, default_retry_delay=60)
+def fetch_bug_history(self, bz_ids=None):
+    """
+    Append the changes made to the given bugs (all saved bugs if not given) since the
+    latest change of theirs saved. Retries only fetch what the failed run didn't save.
+    """
+    if bz_ids is None:
+        bz_ids = Bug.objects.values_list('bz_id', flat=True)
+    importer = HistoryImporter(BugzillaAPI())
+    with import_run('fetch_bug_history'):
+        try:
+            importer.save_history(bz_ids)
+        except BugzillaAPIError as e:
+            raise self.retry(exc=e)
+    logger.info("Saved %d bug history entries", importer.saved_count)
+    return importer.saved_count
+
+
+@app.task(bind=True, max_retries=3, default_retry_delay=60)
+def fetch_bug_attachments(self, bz_ids=None, download=True):
+    """
+    Save the attachments of the given bugs (all saved bugs if not given),
+    downloading their content if `download`.
+    """
+    if bz_ids is None:
+        bz_ids = Bug.objects.values_list('bz_id', flat=True)
+    importer = AttachmentImporter(BugzillaAPI())
+    with import_run('fetch_bug_attachments'):
+        try:
+            importer.save_attachments(bz_ids, download=download)
+        except BugzillaAPIError as e:
+            raise self.retry(exc=e)
+    logger.info("Saved %d attachments, downloaded %d", importer.saved_count, importer.downloaded_count)
+    return importer.saved_count
+
+
+@periodic_task(run_every=crontab(minute=55, hour=23))
+def snapshot_bug_counts():
+    """
+    Daily copy of the BugCount rollup as BugCountSnapshot rows, for trend lines.
+    """
+    count = take_snapshot()
+    logger.info("Saved %d bug count snapshot rows", count)
+    return count
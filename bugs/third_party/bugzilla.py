@@ -1,13 +1,44 @@
+import collections
+import itertools
+import logging
+import time
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
+
 import six
+from six.moves.urllib.parse import parse_qs, urlparse
 
 import requests as r
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from bugs import models
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.timezone import utc
+from bugs import models, rollups
+from bugs.lookups import LookupCache, UserResolver
+from bugs.metrics import metrics
+from bugs.third_party.cache import ResponseCache
+from bugs.third_party.jsonstream import iter_base64_json_field, loads
+from bugs.third_party.throttle import get_backoff_delay, get_host_throttle, get_retry_after
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
+
+class BugzillaAPIError(Exception):
+    """
+    Raised by the paginated fetchers when Bugzilla can't be fetched from,
+    `response` holds the failed response (or its text when it was unparseable,
+    or the connection error when there was no response at all).
+    """
+
+    def __init__(self, message, response=None):
+        super(BugzillaAPIError, self).__init__(message)
+        self.response = response
+
 
 class BugzillaAPI(object):
 
@@ -28,10 +59,55 @@ class BugzillaAPI(object):
     AR_PARAMETERS = 'parameters'
     AR_LAST_AUDIT_TIME = 'last_audit_time'
     AR_ALL_ATTACHMENTS = 'bug/{bug_id}/attachment'
+    AR_BUG_HISTORY = 'bug/{bug_id}/history'
     AR_SPECIFIC_ATTACHMENT = 'bug/attachment/{attachment_id}'
     AR_RESOURCE_FIELDS = 'field/{resource}'
 
-    def __init__(self, search_terms={}, *args, **kwargs):
+    # Number of bugs written per bulk INSERT in `save_bugs`
+    BATCH_SIZE = 500
+    # Number of bugs fetched per request by `iter_bug_pages`
+    PAGE_SIZE = 500
+    # Name of the ImportCheckpoint of incremental syncs
+    SYNC_CHECKPOINT = 'sync'
+    # Statuses worth retrying: rate limited, or server side trouble that usually passes
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # Bytes read at a time when streaming attachment data
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    # Fields of bugs requested with `include_fields`: the ones `_get_bug_values` and
+    # `_get_bug_m2m_values` use. Users are asked for by their plain field name,
+    # Bugzilla sends the matching `*_detail` along.
+    BUG_FIELDS = ('id', 'alias', 'assigned_to', 'blocks', 'cc', 'classification', 'component',
+                  'creation_time', 'creator', 'deadline', 'depends_on', 'dupe_of', 'flags', 'groups',
+                  'is_cc_accessible', 'is_confirmed', 'is_creator_accessible', 'is_open', 'keywords',
+                  'last_change_time', 'op_sys', 'platform', 'priority', 'product', 'qa_contact',
+                  'resolution', 'see_also', 'severity', 'status', 'summary', 'target_milestone',
+                  'url', 'version', 'whiteboard')
+    # Fields of comments and attachments that get stored
+    COMMENT_FIELDS = ('id', 'bug_id', 'attachment_id', 'count', 'creator', 'creation_time', 'is_private', 'text')
+    ATTACHMENT_FIELDS = ('id', 'bug_id', 'creator', 'creation_time', 'last_change_time', 'file_name',
+                         'summary', 'content_type', 'size', 'is_patch', 'is_obsolete', 'is_private')
+    # M2M fields of Bug that are filled in bulk through their through-tables
+    M2M_FIELDS = ('cc', 'flags', 'groups', 'keywords')
+    # Keys in Bugzilla bug json holding users
+    USER_FIELDS = ('assigned_to_detail', 'creator_detail', 'qa_contact', 'cc_detail')
+    # Key in Bugzilla bug json -> SingleFieldModelBase model its values are stored in
+    LOOKUP_FIELDS = (
+        ('classification', models.Classification),
+        ('component', models.Component),
+        ('op_sys', models.OpSys),
+        ('platform', models.Platform),
+        ('priority', models.Priority),
+        ('product', models.Product),
+        ('severity', models.Severity),
+        ('status', models.Status),
+        ('target_milestone', models.TargetMilestone),
+        ('flags', models.Flag),
+        ('groups', models.Group),
+        ('keywords', models.Keyword),
+    )
+
+    def __init__(self, search_terms={}, shared_lookups=False, url_base=None, concurrency=None,
+                 cache=None, timeout=None, max_retries=None, *args, **kwargs):
         if not search_terms:
             search_terms = {'bug_status': ['__open__'],
                             'limit': ['0'],
@@ -40,57 +116,317 @@ class BugzillaAPI(object):
                             'query_format': ['specific']}
         self.search_terms = search_terms
         self.chosen_resource = ''
-        self.url_base = settings.BUGZILLA_REST_BASE
-
-    def _get_api_resource_path(self):
-        return "{}/{}".format(self.url_base, self.chosen_resource)
+        # Can be pointed elsewhere, e.g. at a `bugzilla_stub.StubBugzillaServer`
+        self.url_base = url_base or settings.BUGZILLA_REST_BASE
+        # Number of pages fetched in parallel by `iter_bug_pages`
+        self.concurrency = concurrency or settings.BUGZILLA_FETCH_CONCURRENCY
+        # One keep-alive connection pool shared by all requests (and threads) of this client
+        self.session = r.Session()
+        adapter = r.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.throttle = get_host_throttle(self.url_base, settings.BUGZILLA_REQUESTS_PER_SECOND,
+                                          settings.BUGZILLA_REQUEST_BURST)
+        # (connect, read) seconds, see `_request`
+        self.timeout = timeout or settings.BUGZILLA_REQUEST_TIMEOUT
+        self.max_retries = settings.BUGZILLA_MAX_RETRIES if max_retries is None else max_retries
+        # Anything with ResponseCache's lookup/store/revalidated, None to not cache
+        if cache is None and settings.BUGZILLA_HTTP_CACHE_PATH:
+            cache = ResponseCache(settings.BUGZILLA_HTTP_CACHE_PATH, settings.BUGZILLA_HTTP_CACHE_MAX_SIZE)
+        self.cache = cache
+        # Process-wide when `shared_lookups`, else only for the lifetime of this instance
+        self.lookups = LookupCache(shared=shared_lookups)
+        # email -> pk of every user seen during this import
+        self.users = UserResolver()
+
+    def _get_api_resource_path(self, resource=None):
+        return "{}/{}".format(self.url_base, resource or self.chosen_resource)
 
     def _get_detail_object_path(self, id):
         return "{}/{}".format(self._get_api_resource_path(), id)
 
+    def _request(self, url, params=None, **kwargs):
+        """
+        GET given url through the pooled session, respecting the politeness limits
+        of the Bugzilla host, with a timeout so a stalled socket can't hang a crawl.
+
+        Connection errors, timeouts and `RETRY_STATUSES` are retried up to `max_retries`
+        times, with jittered exponential backoff. A Retry-After sent with 429/503 is
+        honored, and pauses every thread talking to the host.
+        Raises BugzillaAPIError once retries of a connection error are exhausted,
+        the last response is returned otherwise.
+        Requests, their latency and the bytes of non-streamed responses are counted in `metrics`.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self.throttle.wait()
+            start = time.time()
+            try:
+                response = self.session.get(url, params=params, **kwargs)
+            except (r.ConnectionError, r.Timeout) as e:
+                metrics.incr('http_errors', error=type(e).__name__)
+                if attempt >= self.max_retries:
+                    raise BugzillaAPIError("Request to %s failed after %d retries" % (url, attempt), e)
+                delay = get_backoff_delay(attempt, settings.BUGZILLA_BACKOFF_BASE, settings.BUGZILLA_BACKOFF_MAX)
+                logger.warning("%s, retrying in %.1fs", e, delay)
+            else:
+                if not kwargs.get('stream'):
+                    # Reads the body, so the latency covers the whole download
+                    metrics.incr('http_bytes', len(response.content))
+                metrics.observe('http_request', time.time() - start)
+                metrics.incr('http_requests', status=response.status_code)
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                retry_after = get_retry_after(response)
+                delay = get_backoff_delay(attempt, settings.BUGZILLA_BACKOFF_BASE, settings.BUGZILLA_BACKOFF_MAX,
+                                          retry_after)
+                logger.warning("HTTP %d from %s, retrying in %.1fs", response.status_code, url, delay)
+                response.close()
+                if retry_after is not None:
+                    # The host said how long to leave it alone, for all of us
+                    self.throttle.pause(delay)
+            metrics.incr('http_retries')
+            time.sleep(delay)
+            attempt += 1
+
+    def _get(self, resource, params=None, **kwargs):
+        """
+        GET given API resource with `_request`.
+
+        With a cache, fresh cached responses are returned without any request, and
+        stale ones are revalidated with a conditional request when possible.
+        Streamed responses are never cached.
+        """
+        url = self._get_api_resource_path(resource)
+        if self.cache is None or kwargs.get('stream'):
+            return self._request(url, params=params, **kwargs)
+
+        entry = self.cache.lookup(resource, url, params)
+        if entry is not None and entry.fresh:
+            metrics.incr('http_cache_hits')
+            return entry.to_response()
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            headers.update(entry.conditional_headers())
+        response = self._request(url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            metrics.incr('http_cache_revalidations')
+            self.cache.revalidated(entry)
+            return entry.to_response()
+        if response.status_code == 200:
+            self.cache.store(resource, url, params, response)
+        return response
+
     def fetch_bugs(self, get_params={}):
         self.chosen_resource = self.AR_BUG
-        params = self.search_terms
-        if get_params:
-            params = get_params
-        print("Fetching bugs ...")
-        response = r.get(self._get_api_resource_path(), params=params)
+        params = dict(get_params or self.search_terms)
+        # Only what gets stored, unless the caller asked for something else
+        params.setdefault('include_fields', ','.join(self.BUG_FIELDS))
+        logger.debug("Fetching bugs with %s", params)
+        response = self._get(self.AR_BUG, params=params)
         if response.ok:
             try:
-                return True, response.json()['bugs']
+                bugs = loads(response.content)['bugs']
+                metrics.incr('bugs_fetched', len(bugs))
+                return True, bugs
             except (ValueError, KeyError):
                 # In case they send bad data even on HTTP 200 OK
                 # OR if `bugs` object is not present in JSON response.
                 return False, response.text
         else:
-            print("Bug fetch failure")
+            logger.warning("Bug fetch failure: HTTP %d", response.status_code)
             return False, response
 
-    def _get_users(self, user_details):
+    def _fetch_per_bug(self, resource, bz_ids, params):
         """
-        Input can be dict of single user or list of dicts.
-        Output will be list of gotten or created users.
+        GET a `bug/{bug_id}/...` resource for several bugs at once: the first bug goes
+        in the path, the others in `ids`. Bugzilla answers with {"bugs": {<bug id>: ...}},
+        or for history {"bugs": [{"id": <bug id>, ...}]}.
+        Returns (True, dict of bz_id -> value) or (False, error) like `fetch_bugs`.
+        """
+        bz_ids = sorted(bz_ids)
+        params = dict(params, ids=bz_ids[1:])
+        response = self._get(resource.format(bug_id=bz_ids[0]), params=params)
+        if response.ok:
+            try:
+                bugs = loads(response.content)['bugs']
+                if isinstance(bugs, list):
+                    return True, {bug['id']: bug for bug in bugs}
+                return True, {int(bug_id): value for bug_id, value in bugs.items()}
+            except (ValueError, KeyError):
+                return False, response.text
+        else:
+            return False, response
+
+    def fetch_comments(self, bz_ids, new_since=None):
+        """
+        Fetch the comments of the given bugs in one request, only the ones made after
+        `new_since` if given. Returns (True, dict of bz_id -> list of comment dicts)
+        or (False, error).
+        """
+        params = {'include_fields': ','.join(self.COMMENT_FIELDS)}
+        if new_since:
+            params['new_since'] = new_since.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        success, bugs_or_error = self._fetch_per_bug(self.AR_ALL_COMMENTS, bz_ids, params)
+        if success:
+            return True, {bz_id: bug['comments'] for bz_id, bug in bugs_or_error.items()}
+        return False, bugs_or_error
+
+    def fetch_history(self, bz_ids, new_since=None):
+        """
+        Fetch the history (changelog) of the given bugs in one request, only the changes made
+        after `new_since` if given. Returns (True, dict of bz_id -> list of history dicts,
+        each with `when`, `who` and a list of `changes`) or (False, error).
+        """
+        params = {}
+        if new_since:
+            params['new_since'] = new_since.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        success, bugs_or_error = self._fetch_per_bug(self.AR_BUG_HISTORY, bz_ids, params)
+        if success:
+            return True, {bz_id: bug['history'] for bz_id, bug in bugs_or_error.items()}
+        return False, bugs_or_error
+
+    def fetch_attachments(self, bz_ids):
+        """
+        Fetch the attachments metadata of the given bugs in one request, without their data.
+        Returns (True, dict of bz_id -> list of attachment dicts) or (False, error).
+        """
+        params = {'include_fields': ','.join(self.ATTACHMENT_FIELDS)}
+        return self._fetch_per_bug(self.AR_ALL_ATTACHMENTS, bz_ids, params)
+
+    def download_attachment(self, attachment_id, fileobj):
+        """
+        Stream the content of given attachment into `fileobj`, decoding the base64
+        `data` as it arrives, so that big attachments are never held in memory.
+        Returns (True, number of bytes written) or (False, error).
+        """
+        resource = self.AR_SPECIFIC_ATTACHMENT.format(attachment_id=attachment_id)
+        response = self._get(resource, params={'include_fields': 'data'}, stream=True)
+        if not response.ok:
+            return False, response
+        size = 0
+        with closing(response):
+            try:
+                for data in iter_base64_json_field(response.iter_content(self.DOWNLOAD_CHUNK_SIZE), 'data'):
+                    fileobj.write(data)
+                    size += len(data)
+            except (ValueError, TypeError) as e:
+                # No data in the response, or data that isn't base64
+                return False, e
+        metrics.incr('http_bytes', size)
+        return True, size
+
+    def _normalize_user_details(self, user_details):
+        """
+        Input can be dict of single user, email of single user or list of dicts.
+        Returns tuple of (list of user dicts, whether input was a single user).
         """
-        users = []
-        return_single = False
         if isinstance(user_details, dict):
-            return_single = True
-            user_details = [user_details]
+            return [user_details], True
         elif isinstance(user_details, six.string_types):
-            return_single = True
-            user_details = [{'email': user_details, 'real_name': user_details}]
+            # Bugzilla sends an empty string when there is no such user (e.g. qa_contact)
+            if not user_details:
+                return [], True
+            return [{'email': user_details, 'real_name': user_details}], True
+        return user_details or [], False
+
+    def _fetch_bug_page(self, params, offset):
+        params = dict(params, offset=offset)
+        success, bugs_or_error = self.fetch_bugs(get_params=params)
+        if not success:
+            raise BugzillaAPIError("Bug fetch failure at offset %d" % offset, bugs_or_error)
+        return bugs_or_error
+
+    def iter_bug_pages(self, page_size=None, offset=0, get_params={}, concurrency=None):
+        """
+        Generator walking the bug search page by page using limit and offset,
+        yielding the list of bug dicts of each page as soon as it is fetched.
+        So only a few pages of bugs need to be held in memory at a time.
 
-        if not user_details:
-            if return_single:
-                return
-            return []
-
-        for detail in user_details:
-            user, _ = User.objects.get_or_create(
-                email=detail['email'],
-                name=detail['real_name'],
-            )
-            users.append(user)
+        Up to `concurrency` (default `self.concurrency`) pages are fetched ahead in
+        background threads while the caller is busy with the page yielded to it.
+        Pages are still yielded in order.
+
+        `get_params` are used as search terms instead of `self.search_terms` if given.
+        Pages are ordered by bug id so that offsets stay stable while walking them.
+        Raises BugzillaAPIError if a page can't be fetched.
+        """
+        page_size = page_size or self.PAGE_SIZE
+        concurrency = concurrency or self.concurrency
+        params = dict(get_params or self.search_terms)
+        params['order'] = 'bug_id'
+        params['limit'] = page_size
+
+        pool = ThreadPool(concurrency)
+        pending = collections.deque()
+        try:
+            for _ in range(concurrency):
+                pending.append(pool.apply_async(self._fetch_bug_page, (params, offset)))
+                offset += page_size
+            while pending:
+                bugs = pending.popleft().get()
+                if bugs:
+                    yield bugs
+                if len(bugs) < page_size:
+                    # Last page, the ones still pending are past the end.
+                    return
+                pending.append(pool.apply_async(self._fetch_bug_page, (params, offset)))
+                offset += page_size
+        finally:
+            # Let the requests still in flight finish, rather than leaving threads behind
+            pool.close()
+            pool.join()
+
+    def _add_search_criterion(self, params, field, operator, value):
+        """
+        Return copy of given search terms with the custom search criterion
+        `field` `operator` `value` (e.g. bug_id greaterthan 100) added.
+        """
+        params = dict(params)
+        # Custom search criteria are numbered f1/o1/v1, f2/o2/v2 ..., add ours after any existing
+        n = 1 + max([int(key[1:]) for key in params if key[:1] == 'f' and key[1:].isdigit()] or [0])
+        params.update({'query_format': 'advanced', 'f%d' % n: field, 'o%d' % n: operator, 'v%d' % n: value})
+        return params
+
+    def get_id_range_params(self, first_id, last_id, get_params={}):
+        """
+        Return the search terms (`get_params` or `self.search_terms`) narrowed down
+        to bugs with id between `first_id` and `last_id`, both inclusive.
+        """
+        params = self._add_search_criterion(get_params or self.search_terms, 'bug_id', 'greaterthaneq', first_id)
+        return self._add_search_criterion(params, 'bug_id', 'lessthaneq', last_id)
+
+    def get_max_bug_id(self, get_params={}):
+        """
+        Return the highest bug id matching the search terms (`get_params` or `self.search_terms`),
+        None if no bug matches.
+        """
+        params = dict(get_params or self.search_terms, order='bug_id DESC', limit=1, include_fields='id')
+        success, bugs_or_error = self.fetch_bugs(get_params=params)
+        if not success:
+            raise BugzillaAPIError("Couldn't fetch the highest bug id", bugs_or_error)
+        if bugs_or_error:
+            return bugs_or_error[0]['id']
+
+    def iter_bugs(self, page_size=None, offset=0, get_params={}, concurrency=None):
+        """
+        Same as `iter_bug_pages`, but yielding one bug dict at a time.
+        """
+        for bugs in self.iter_bug_pages(page_size, offset, get_params, concurrency):
+            for bug_detail in bugs:
+                yield bug_detail
+
+    def _get_users(self, user_details):
+        """
+        Input can be dict of single user or list of dicts.
+        Output will be list of gotten or created users.
+        Returned users are (unsaved) instances carrying just pk and email,
+        which is all that is needed to assign them to a FK or add them to a M2M.
+        """
+        user_details, return_single = self._normalize_user_details(user_details)
+        email_to_pk = self.users.resolve(user_details)
+        users = [User(pk=email_to_pk[detail['email']], email=detail['email']) for detail in user_details]
         if return_single:
             if users:
                 return users[0]
@@ -98,6 +434,17 @@ class BugzillaAPI(object):
                 return
         return users
 
+    def _prime_users(self, bug_details):
+        """
+        Resolve all users referred to by the given bugs with one query
+        (plus one bulk INSERT for users not yet in the database).
+        """
+        user_details = []
+        for bug_detail in bug_details:
+            for key in self.USER_FIELDS:
+                user_details.extend(self._normalize_user_details(bug_detail[key])[0])
+        self.users.resolve(user_details)
+
     def _get_bugs(self,  bug_ids, fk=False):
         """
         bug_ids: Can be list or one value.
@@ -111,70 +458,104 @@ class BugzillaAPI(object):
             # and to safely return None
             return models.Bug.objects.filter(bz_id=bug_ids).first()
 
-    def _get_non_user_fk_objects(self, input, model):
-        return model.objects.get_or_create(name=input)[0]
+    def _get_lookup_name(self, value):
+        # Bug flags come as dicts (name, status, setter...), other lookups as plain strings
+        if isinstance(value, dict):
+            return value['name']
+        return value
+
+    def _get_lookup_key(self, value, model, bug_detail=None):
+        """
+        Key of given lookup value in `self.lookups`: its name, or for models with a composite
+        `NATURAL_KEY` the tuple of the name and the other key fields' values in `bug_detail`
+        (e.g. the product of a Component).
+        """
+        name = self._get_lookup_name(value)
+        if len(model.NATURAL_KEY) == 1:
+            return name
+        return tuple(name if field == 'name' else bug_detail[field] for field in model.NATURAL_KEY)
+
+    def _get_non_user_fk_objects(self, input, model, bug_detail=None):
+        """
+        Returns an (unsaved) instance carrying just the pk, which is all that is
+        needed to assign it to a FK or add it to a M2M.
+        """
+        pk = self.lookups.get_pk(model, self._get_lookup_key(input, model, bug_detail))
+        return model(pk=pk, name=self._get_lookup_name(input))
 
     def _get_non_user_m2m_objects(self, input_list, model):
-        return [model.objects.get_or_create(name=val)[0] for val in input_list]
+        return [self._get_non_user_fk_objects(val, model) for val in input_list]
+
+    def _prime_lookups(self, bug_details):
+        """
+        Resolve all lookups used by the given bugs with one query per model
+        (plus one bulk INSERT per model for keys not yet in the database),
+        so building the bugs afterwards doesn't touch the database for them.
+        """
+        for key, model in self.LOOKUP_FIELDS:
+            lookup_keys = set()
+            for bug_detail in bug_details:
+                values = bug_detail[key]
+                if not isinstance(values, list):
+                    values = [values]
+                lookup_keys.update(self._get_lookup_key(value, model, bug_detail) for value in values)
+            self.lookups.resolve(model, lookup_keys)
 
     def _add_m2m_field_objects(self, bug, cc, flags, groups, keywords):
-        bug.cc.add(*cc)
-        bug.flags.add(*flags)
-        bug.groups.add(*groups)
-        bug.keywords.add(*keywords)
-
-    def _filter_bugs(self, bz_id_list, single=False):
-        if single:
-            return models.Bug.objects.filter(bz_id=bz_id_list).first()
-        return models.Bug.objects.filter(bz_id__in=bz_id_list)
-
-    def _clear_pending_fk_and_m2m_to_self(self, mapping):
-        """
-        mapping = {
-            <bz_id>: {
-                'blocks': [],
-                'depends_on': [],
-                'see_also': [],
-            }
-        }
+        # By pk: the user and lookup instances are unsaved, which M2M add() refuses
+        bug.cc.add(*[user.pk for user in cc])
+        bug.flags.add(*[flag.pk for flag in flags])
+        bug.groups.add(*[group.pk for group in groups])
+        bug.keywords.add(*[keyword.pk for keyword in keywords])
 
-        This func basically does this for all the non-user m2m fields in Bug:
-        bug.<m2m_field>.add([list of m2m objects on that field])
+    def _bulk_add_m2m_field_objects(self, bugs_with_m2m):
         """
-        bz_ids = mapping.keys()
-        bugs = self._filter_bugs(bz_ids)
+        bugs_with_m2m: list of (bug, m2m values) tuples, where m2m values is the dict
+        returned by `_get_bug_m2m_values` and bug has already been saved.
+
+        Does the same as `_add_m2m_field_objects`, but with a single INSERT
+        per through-table for the whole list of bugs.
         """
-        for bug in to_be_cleared_bugs:
-            get `field` list of bug ids
-                for m2m_bug_id in bug ids;
-                    m2m_bug = models.Bug.objects.filter(bz_id=m2m_bug_id)
-                    if m2m_bug:
-                        add m2m_bug
-                    else:
-                        m2m_bug = self.fetch_single_bug(m2m_bug_id)
-                        add m2m_bug
-        """
-        for bug in bugs:
-            for field in ['blocks', 'depends_on', 'see_also']:
-                print("Clearing %s for bug %d" % (field, bug.bz_id))
-                # getattr(bug, field).add(*self._filter_bugs(mapping[bug.bz_id][field]))
-                field_m2m_bugs = []
-                for m2m_bug_id in mapping[bug.bz_id][field]:
-                    m2m_bug = models.Bug.objects.filter(bz_id=m2m_bug_id)
-                    if m2m_bug:
-                        field_m2m_bugs.append(m2m_bug)
-                    else:
-                        # The recursive rabbit hole
-                        m2m_bug_detail = self.fetch_bugs(m2m_bug_id, get_params={'id': m2m_bug_id})
-                        m2m_bug = self._create_bug(m2m_bug_detail)
-                        field_m2m_bugs.append(m2m_bug)
-                        # In worst case scenario, we could see each field having 3-4 bugs
-                        # If assuming only 1 field of these 3 would always link to an unsaved bug
-                        # and that kept happening for 10 jumps straight, we're looking at 1024 recursions.
-                        # And even though we can change that with sys.setrecursionlimit(n), it's a bad implementation.
-                        # We can flatten it out in periodic checks and clearing up in a background task
-                        # BUT, that's beyond the scope of this assignment.
-                getattr(bug, field).add(*field_m2m_bugs)
+        for field_name in self.M2M_FIELDS:
+            field = models.Bug._meta.get_field(field_name)
+            through = field.remote_field.through
+            bug_column, target_column = field.m2m_column_name(), field.m2m_reverse_name()
+            rows = set()
+            for bug, m2m in bugs_with_m2m:
+                rows.update((bug.pk, obj.pk) for obj in m2m[field_name])
+            through.objects.bulk_create([
+                through(**{bug_column: bug_pk, target_column: target_pk})
+                for bug_pk, target_pk in rows
+            ])
+
+    def _bulk_set_m2m_field_objects(self, bugs_with_m2m):
+        """
+        Like `_bulk_add_m2m_field_objects`, but for bugs that already have M2Ms:
+        makes each M2M of each bug hold exactly the given objects, by diffing against
+        the current through-table rows (one SELECT, one INSERT and one DELETE per through-table).
+        """
+        bug_pks = [bug.pk for bug, _ in bugs_with_m2m]
+        if not bug_pks:
+            return
+        for field_name in self.M2M_FIELDS:
+            field = models.Bug._meta.get_field(field_name)
+            through = field.remote_field.through
+            bug_column, target_column = field.m2m_column_name(), field.m2m_reverse_name()
+            current_rows = {
+                (bug_pk, target_pk): row_pk
+                for row_pk, bug_pk, target_pk in through.objects.filter(
+                    **{bug_column + '__in': bug_pks}).values_list('pk', bug_column, target_column)
+            }
+            rows = set()
+            for bug, m2m in bugs_with_m2m:
+                rows.update((bug.pk, obj.pk) for obj in m2m[field_name])
+            through.objects.bulk_create([
+                through(**{bug_column: bug_pk, target_column: target_pk})
+                for bug_pk, target_pk in rows.difference(current_rows)
+            ])
+            stale_row_pks = [row_pk for row, row_pk in current_rows.items() if row not in rows]
+            if stale_row_pks:
+                through.objects.filter(pk__in=stale_row_pks).delete()
 
     def _already_saved(self, bug_detail):
         """
@@ -182,39 +563,51 @@ class BugzillaAPI(object):
         """
         return models.Bug.objects.filter(bz_id=bug_detail['id']).exists()
 
-    def _create_bug(self, bug_detail):
+    def _get_bug_m2m_values(self, bug_detail):
         """
         Given dict of bug details from Bugzilla bugs API,
-        this function will create and return the Bug model instance for it.
+        return dict of the objects to be added on each M2M field of Bug.
         """
+        return dict(
+            cc=self._get_users(bug_detail['cc_detail']),
+            flags=self._get_non_user_m2m_objects(bug_detail['flags'], models.Flag),
+            groups=self._get_non_user_m2m_objects(bug_detail['groups'], models.Group),
+            keywords=self._get_non_user_m2m_objects(bug_detail['keywords'], models.Keyword),
+        )
 
+    def _get_show_bug_url(self):
         """
-        Initially had modelled these as FK (dupe_of) and M2Ms,
-        Had written a lot of supporting code also, to manage these
-        (check _clear_pending_fk_and_m2m_to_self etc)
-        But then problem of them not existing on creation, and then
-        recursively getting them would be unnecessary time waste for the
-        purpose of this assignment. Because that would be long implementation
-        requiring another celery task that periodically checks Bug records
-        in which these fields should be populated but aren't, and then populate them.
-        Not a rabbit hole I want to go down into, as I have lot of pressing issues
-        to take care of in the little time I have. Hope this is understandable.
-        SO, had to go with postgres specific ArrayField instead, as anyways,
-        the point is to simply store and nothing else on top of it, as required.
-
-        # pending_fk_and_m2m_to_self = dict(
-        #     blocks=bug_detail['blocks'],
-        #     depends_on=bug_detail['depends_on'],
-        #     see_also=bug_detail['see_also'],
-        # )
+        (scheme, host, path) of the `show_bug.cgi` page of this Bugzilla, whose REST API
+        (`url_base`) is at `<Bugzilla base>/rest.cgi` or `<Bugzilla base>/rest`.
         """
+        url = urlparse(self.url_base)
+        base_path = url.path.rstrip('/').rsplit('/', 1)[0]
+        return url.scheme, url.netloc.lower(), base_path + '/show_bug.cgi'
 
-        cc = self._get_users(bug_detail['cc_detail'])
-        flags = self._get_non_user_m2m_objects(bug_detail['flags'], models.Flag)
-        groups = self._get_non_user_m2m_objects(bug_detail['groups'], models.Group)
-        keywords = self._get_non_user_m2m_objects(bug_detail['keywords'], models.Keyword)
-
-        values = dict(
+    def _get_see_also_ids(self, see_also_urls):
+        """
+        Bug ids of the `show_bug.cgi?id=<id>` urls of this Bugzilla among given see_also urls.
+        Urls of other trackers (JIRA, GitHub, other Bugzillas ...) are skipped, their ids
+        are not the ids of our bugs.
+        """
+        show_bug_url = self._get_show_bug_url()
+        ids = []
+        for see_also_url in see_also_urls:
+            url = urlparse(see_also_url)
+            if (url.scheme, url.netloc.lower(), url.path) != show_bug_url:
+                continue
+            bug_id = parse_qs(url.query).get('id', [''])[0]
+            # Could be an alias
+            if bug_id.isdigit():
+                ids.append(int(bug_id))
+        return ids
+
+    def _get_bug_values(self, bug_detail):
+        """
+        Given dict of bug details from Bugzilla bugs API,
+        return dict of field values (without M2Ms) to create the Bug instance with.
+        """
+        return dict(
             bz_id=bug_detail['id'],
             alias=",".join(bug_detail['alias']),
             assigned_to=self._get_users(bug_detail['assigned_to_detail']),
@@ -222,10 +615,10 @@ class BugzillaAPI(object):
             blocks=bug_detail['blocks'],
             depends_on=bug_detail['depends_on'],
             dupe_of=bug_detail['dupe_of'],
-            see_also=[sa.split('=')[-1] for sa in bug_detail['see_also']],
+            see_also=self._get_see_also_ids(bug_detail['see_also']),
 
             classification=self._get_non_user_fk_objects(bug_detail['classification'], models.Classification),
-            component=self._get_non_user_fk_objects(bug_detail['component'], models.Component),
+            component=self._get_non_user_fk_objects(bug_detail['component'], models.Component, bug_detail),
             creation_time=bug_detail['creation_time'],
             creator=self._get_users(bug_detail['creator_detail']),
             deadline=bug_detail['deadline'],
@@ -248,37 +641,194 @@ class BugzillaAPI(object):
             version=bug_detail['version'],
             whiteboard=bug_detail['whiteboard'],
         )
-        bug = models.Bug.objects.create(**values)
-        print("Saved bug %d" % bug.bz_id)
-        self._add_m2m_field_objects(bug, cc, flags, groups, keywords)
-        print("Added M2M to bug %d" % bug.bz_id)
 
-        # Set all the fk and m2m relations to self (Bug to Bug) for all the bugs processed above.
-        # self._clear_pending_fk_and_m2m_to_self(pending_fk_and_m2m_to_self)
+    def _create_bug(self, bug_detail):
+        """
+        Given dict of bug details from Bugzilla bugs API,
+        this function will create and return the Bug model instance for it.
+        """
+
+        """
+        Initially had modelled these as FK (dupe_of) and M2Ms,
+        Had written a lot of supporting code also, to manage these
+        (check _clear_pending_fk_and_m2m_to_self etc in patches/)
+        But then problem of them not existing on creation, and then
+        recursively getting them would be unnecessary time waste for the
+        purpose of this assignment. Because that would be long implementation
+        requiring another celery task that periodically checks Bug records
+        in which these fields should be populated but aren't, and then populate them.
+        Not a rabbit hole I want to go down into, as I have lot of pressing issues
+        to take care of in the little time I have. Hope this is understandable.
+        SO, had to go with postgres specific ArrayField instead, as anyways,
+        the point is to simply store and nothing else on top of it, as required.
 
+        The real relations are now materialized afterwards as BugLink rows,
+        by `bugs.links.BugLinkResolver`, in a separate stage.
+        """
+
+        # Users and lookups are resolved one bug at a time on this path
+        with metrics.timer('stage', stage='resolve'):
+            m2m = self._get_bug_m2m_values(bug_detail)
+            values = self._get_bug_values(bug_detail)
+        with metrics.timer('stage', stage='create'):
+            bug = models.Bug.objects.create(**values)
+        with metrics.timer('stage', stage='m2m'):
+            self._add_m2m_field_objects(bug, **m2m)
+        metrics.incr('bugs_saved')
+        logger.debug("Saved bug %d", bug.bz_id)
         return bug
 
-    def save_bugs(self, bugs=[]):
+    def save_bugs(self, bugs=[], batch_size=None, update_existing=False):
         """
         Create the bug as it is, without the FK or M2M.
-        While processing through the bug list, keep track of bug ids and their FK/M2M to self
-        Save those relations after all bugs have been created.
+        Bugs are saved in batches of `batch_size` (default `BATCH_SIZE`), see `_save_bug_batch`.
+        Bugs already saved are skipped, unless `update_existing` is set.
 
-        `pending_fk_and_m2m_to_self`: This variable will store all the relations of FK and M2M of Bug to self
-        Because while creating, it is possible that in the data we get bugs that
-        have not been yet created but are present as `blocks` or `depends_on` etc.
+        Relations of Bug to self (`blocks`, `depends_on` etc) are only stored as bz ids here,
+        because in the data we can get bugs referring to bugs that have not been created yet.
+        They are turned into BugLink rows afterwards by `bugs.links.BugLinkResolver`.
         """
 
-        # Process through all bugs fetched
+        # Process through all bugs fetched, one batch at a time
         ctr = 0
-        for bug_detail in bugs:
-            print("\n======\nProcessing bug {}\n".format(bug_detail['id']))
-            if not self._already_saved(bug_detail):
-                # bug, pending_fk_and_m2m_to_self = self._create_bug(bug_detail)
-                self._create_bug(bug_detail)
-                ctr += 1
+        bugs = iter(bugs)
+        while True:
+            batch = list(itertools.islice(bugs, batch_size or self.BATCH_SIZE))
+            if not batch:
+                break
+            ctr += self._save_bug_batch(batch, update_existing)
         return ctr
 
+    def _save_bug_batch(self, bug_details, update_existing=False):
+        """
+        Given list of bug details from Bugzilla bugs API, create the ones not already saved.
+        With `update_existing`, bugs already saved whose `last_change_time` differs
+        are updated too (scalar fields and FKs overwritten, M2M sets diffed).
+
+        All Bug rows are written with a single `INSERT ... ON CONFLICT (bz_id)` (see
+        `BugManager.upsert`), so concurrent imports of the same bugs are safe, and
+        their M2Ms with one INSERT per through-table. The BugCount rollup is updated
+        in the same transaction (see `bugs.rollups`).
+        Returns the number of bugs created or updated.
+        """
+        # Guards against the same bug appearing twice in a batch
+        bug_details = list(collections.OrderedDict(
+            (bug_detail['id'], bug_detail) for bug_detail in bug_details).values())
+
+        with metrics.timer('stage', stage='lookups'):
+            self._prime_lookups(bug_details)
+        with metrics.timer('stage', stage='users'):
+            self._prime_users(bug_details)
+        with metrics.timer('stage', stage='build'):
+            bugs, m2m_by_bz_id = [], {}
+            for bug_detail in bug_details:
+                bugs.append(models.Bug(**self._get_bug_values(bug_detail)))
+                m2m_by_bz_id[bug_detail['id']] = self._get_bug_m2m_values(bug_detail)
+
+        with transaction.atomic():
+            old_groups = {}
+            if update_existing:
+                # What the bugs about to be updated were counted as in the BugCount rollup
+                with metrics.timer('stage', stage='rollups'):
+                    old_groups = rollups.get_saved_groups(list(m2m_by_bz_id))
+            bugs_with_m2m, changed_bugs_with_m2m = [], []
+            bug_by_bz_id = {bug.bz_id: bug for bug in bugs}
+            with metrics.timer('stage', stage='upsert'):
+                for pk, bz_id, inserted in models.Bug.objects.upsert(bugs, update_existing):
+                    bug = bug_by_bz_id[bz_id]
+                    bug.pk = pk
+                    if inserted:
+                        bugs_with_m2m.append((bug, m2m_by_bz_id[bz_id]))
+                    else:
+                        changed_bugs_with_m2m.append((bug, m2m_by_bz_id[bz_id]))
+            with metrics.timer('stage', stage='m2m'):
+                self._bulk_add_m2m_field_objects(bugs_with_m2m)
+                self._bulk_set_m2m_field_objects(changed_bugs_with_m2m)
+            with metrics.timer('stage', stage='rollups'):
+                rollups.count_saved_bugs([inserted_bug for inserted_bug, _ in bugs_with_m2m],
+                                         [updated_bug for updated_bug, _ in changed_bugs_with_m2m], old_groups)
+        skipped = len(bug_details) - len(bugs_with_m2m) - len(changed_bugs_with_m2m)
+        metrics.incr('bugs_saved', len(bugs_with_m2m) + len(changed_bugs_with_m2m))
+        metrics.incr('bugs_inserted', len(bugs_with_m2m))
+        metrics.incr('bugs_updated', len(changed_bugs_with_m2m))
+        metrics.incr('bugs_skipped', skipped)
+        logger.info("Saved batch of %d bugs (%d updated, %d already saved)",
+                    len(bugs_with_m2m), len(changed_bugs_with_m2m), skipped)
+        return len(bugs_with_m2m) + len(changed_bugs_with_m2m)
+
+    def get_sync_watermark(self):
+        """
+        High-water mark for incremental syncs: the latest `last_change_time` among saved bugs,
+        None if nothing was imported yet.
+        """
+        return models.Bug.objects.aggregate(watermark=Max('last_change_time'))['watermark']
+
+    def get_checkpoint(self, name, watermark=None):
+        """
+        Return the ImportCheckpoint named `name`, to resume the import from if it didn't finish,
+        or reset to start the import over (with given `watermark`) if it did.
+        """
+        checkpoint, created = models.ImportCheckpoint.objects.get_or_create(
+            name=name, defaults={'watermark': watermark})
+        if checkpoint.finished_at:
+            checkpoint.last_bz_id = None
+            checkpoint.watermark = watermark
+            checkpoint.pages_count = checkpoint.saved_count = 0
+            checkpoint.started_at = timezone.now()
+            checkpoint.finished_at = None
+            checkpoint.save()
+        elif not created and checkpoint.last_bz_id:
+            logger.info("Resuming import %s after bug %d", name, checkpoint.last_bz_id)
+        return checkpoint
+
+    def import_bugs(self, checkpoint, get_params={}, page_size=None, update_existing=False):
+        """
+        Fetch and save the bugs matching the search terms (`get_params` or `self.search_terms`)
+        page by page, recording progress in given ImportCheckpoint (see `get_checkpoint`),
+        and only fetching bugs after the last one it saved.
+
+        Each page is saved in a single transaction together with the checkpoint update,
+        so a crash never leaves bugs without their M2M rows, or the checkpoint out of step.
+        Returns the checkpoint, finished.
+        """
+        params = dict(get_params or self.search_terms)
+        if checkpoint.last_bz_id:
+            params = self._add_search_criterion(params, 'bug_id', 'greaterthan', checkpoint.last_bz_id)
+        for bugs in self.iter_bug_pages(page_size=page_size, get_params=params):
+            # Lookups and users are committed beforehand, so the caches never hold
+            # pks of rows that got rolled back with a failed page.
+            self._prime_lookups(bugs)
+            self._prime_users(bugs)
+            with transaction.atomic():
+                checkpoint.saved_count += self.save_bugs(bugs, batch_size=len(bugs),
+                                                         update_existing=update_existing)
+                checkpoint.pages_count += 1
+                checkpoint.last_bz_id = max(bug_detail['id'] for bug_detail in bugs)
+                checkpoint.save()
+        checkpoint.finished_at = timezone.now()
+        checkpoint.save()
+        return checkpoint
+
+    def sync_bugs(self, since=None, page_size=None):
+        """
+        Incremental sync: fetch only the bugs changed on Bugzilla since `since`
+        (default `get_sync_watermark()`), creating new ones and updating changed ones.
+        Falls back to fetching everything when there is no watermark yet.
+
+        An interrupted sync is resumed with the watermark it started with, as the
+        watermark computed from saved bugs has moved on with the bugs it saved.
+        Bugs of every status are fetched, otherwise bugs that got closed since
+        the last sync would never be updated.
+        Returns the finished ImportCheckpoint.
+        """
+        checkpoint = self.get_checkpoint(self.SYNC_CHECKPOINT, watermark=since or self.get_sync_watermark())
+        params = dict(self.search_terms, bug_status='__all__')
+        if checkpoint.watermark:
+            # Bugzilla returns bugs changed at or after this time
+            params['last_change_time'] = checkpoint.watermark.astimezone(utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            logger.info("Syncing bugs changed since %s", params['last_change_time'])
+        return self.import_bugs(checkpoint, get_params=params, page_size=page_size, update_existing=True)
+
 """
 
 func to get sample vals for some bug key - z should be the bug json list
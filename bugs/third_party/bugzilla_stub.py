@@ -0,0 +1,168 @@
+"""
+A local stand-in for the Bugzilla REST API, serving a given list of bug dicts,
+so the fetchers in `bugzilla.BugzillaAPI` can be exercised without bz.apache.org:
+
+    with StubBugzillaServer(bugs) as server:
+        bz = BugzillaAPI(url_base=server.url_base)
+        for page in bz.iter_bug_pages(page_size=100):
+            ...
+"""
+import json
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+
+class StubBugzillaHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        # Keep the stand-in quiet, it would otherwise log every request to stderr
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _get_ids(self, params):
+        # Both `id=1&id=2` and `id=1,2` are accepted by Bugzilla
+        ids = set()
+        for value in params.get('id', []):
+            ids.update(int(bug_id) for bug_id in value.split(',') if bug_id)
+        return ids
+
+    # Custom search operators supported on bug_id (f1=bug_id&o1=greaterthaneq&v1=100)
+    ID_OPERATORS = {
+        'greaterthaneq': lambda bug_id, value: bug_id >= value,
+        'greaterthan': lambda bug_id, value: bug_id > value,
+        'lessthaneq': lambda bug_id, value: bug_id <= value,
+        'lessthan': lambda bug_id, value: bug_id < value,
+        'equals': lambda bug_id, value: bug_id == value,
+    }
+
+    def _filter_custom_search(self, bugs, params):
+        for key in params:
+            if key[:1] != 'f' or not key[1:].isdigit() or params[key][0] != 'bug_id':
+                continue
+            operator = self.ID_OPERATORS[params['o' + key[1:]][0]]
+            value = int(params['v' + key[1:]][0])
+            bugs = [bug for bug in bugs if operator(bug['id'], value)]
+        return bugs
+
+    def search_bugs(self, params):
+        bugs = self.server.bugs
+        ids = self._get_ids(params)
+        if ids:
+            bugs = [bug for bug in bugs if bug['id'] in ids]
+        bugs = self._filter_custom_search(bugs, params)
+        if params.get('order', [''])[0].upper().endswith('DESC'):
+            bugs = bugs[::-1]
+        if 'last_change_time' in params:
+            # Timestamps are all in the same ISO 8601 UTC format, so they compare as strings
+            since = params['last_change_time'][0]
+            bugs = [bug for bug in bugs if bug['last_change_time'] >= since]
+        offset = int(params.get('offset', ['0'])[0])
+        limit = int(params.get('limit', ['0'])[0])
+        bugs = bugs[offset:offset + limit] if limit else bugs[offset:]
+        if 'include_fields' in params:
+            fields = set(','.join(params['include_fields']).split(','))
+            # Like Bugzilla, user fields bring their `*_detail` along
+            bugs = [{key: value for key, value in bug.items()
+                     if key in fields or (key.endswith('_detail') and key[:-len('_detail')] in fields)}
+                    for bug in bugs]
+        return {'bugs': bugs}
+
+    def _get_bug_ids(self, first_bug_id, params):
+        # bug/<id>/comment?ids=<id>&ids=<id>
+        return [int(first_bug_id)] + [int(bug_id) for bug_id in params.get('ids', [])]
+
+    def get_comments(self, first_bug_id, params):
+        return {'bugs': {
+            str(bug_id): {'comments': self.server.comments.get(bug_id, [])}
+            for bug_id in self._get_bug_ids(first_bug_id, params)
+        }, 'comments': {}}
+
+    def get_history(self, first_bug_id, params):
+        since = params.get('new_since', [''])[0]
+        return {'bugs': [
+            {'id': bug_id, 'alias': [], 'history': [
+                entry for entry in self.server.history.get(bug_id, []) if entry['when'] > since
+            ]}
+            for bug_id in self._get_bug_ids(first_bug_id, params)
+        ]}
+
+    def get_attachments(self, first_bug_id, params):
+        return {'bugs': {
+            str(bug_id): [
+                {key: value for key, value in attachment.items() if key != 'data'}
+                for attachment in self.server.attachments.values() if attachment['bug_id'] == bug_id
+            ]
+            for bug_id in self._get_bug_ids(first_bug_id, params)
+        }, 'attachments': {}}
+
+    def get_attachment(self, attachment_id, params):
+        attachment = self.server.attachments.get(int(attachment_id))
+        return {'bugs': {}, 'attachments': {attachment_id: attachment} if attachment else {}}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        resource = url.path[len(self.server.path_prefix):].strip('/')
+        parts = resource.split('/')
+        if resource == 'bug':
+            return self._send_json(self.search_bugs(params))
+        elif len(parts) == 3 and parts[0] == 'bug' and parts[2] == 'comment':
+            return self._send_json(self.get_comments(parts[1], params))
+        elif len(parts) == 3 and parts[0] == 'bug' and parts[2] == 'history':
+            return self._send_json(self.get_history(parts[1], params))
+        elif len(parts) == 3 and parts[0] == 'bug' and parts[2] == 'attachment':
+            return self._send_json(self.get_attachments(parts[1], params))
+        elif len(parts) == 3 and parts[:2] == ['bug', 'attachment']:
+            return self._send_json(self.get_attachment(parts[2], params))
+        return self._send_json({'error': True, 'message': 'Unknown resource %s' % resource}, 404)
+
+
+class StubBugzillaServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves `bugs` (list of dicts as returned in `bugs` by Bugzilla bugs API)
+    on `url_base` from a background thread. Port 0 picks a free port.
+    `comments` is a dict of bug id -> list of comment dicts, `attachments`
+    a dict of attachment id -> attachment dict (with base64 `data`), `history`
+    a dict of bug id -> list of history dicts (`when`, `who`, `changes`).
+    """
+    daemon_threads = True
+    path_prefix = '/rest'
+
+    def __init__(self, bugs, comments=None, attachments=None, history=None, host='127.0.0.1', port=0,
+                 handler_class=StubBugzillaHandler):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), handler_class)
+        self.bugs = sorted(bugs, key=lambda bug: bug['id'])
+        self.comments = comments or {}
+        self.attachments = attachments or {}
+        self.history = history or {}
+        self._thread = None
+
+    @property
+    def url_base(self):
+        return 'http://%s:%d%s' % (self.server_address[0], self.server_address[1], self.path_prefix)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,199 @@
+"""
+On-disk cache of raw Bugzilla API responses, stored in a SQLite database.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests as r
+from requests.structures import CaseInsensitiveDict
+from six.moves.urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+# (path, pid) -> (connection, lock), see `get_database`
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path, timeout=10):
+    """
+    Return the process-wide (sqlite3 connection, lock) of the cache database at `path`, so
+    that the clients of a worker share one connection instead of each opening their own.
+    Keyed by pid too, as connections must not be used across a fork. Other processes using
+    the same file are waited for up to `timeout` seconds when they hold its write lock.
+    """
+    key = (path, os.getpid())
+    with _databases_lock:
+        if key not in _databases:
+            db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+            with db:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS responses ('
+                    ' key TEXT PRIMARY KEY, url TEXT, status_code INTEGER, headers TEXT, body BLOB,'
+                    ' size INTEGER, stored_at REAL, accessed_at REAL)')
+                db.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+            _databases[key] = db, threading.Lock()
+        return _databases[key]
+
+
+class CacheEntry(object):
+
+    def __init__(self, key, url, status_code, headers, body, stored_at, ttl):
+        self.key = key
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.body = body
+        self.stored_at = stored_at
+        self.ttl = ttl
+
+    @property
+    def fresh(self):
+        return time.time() - self.stored_at < self.ttl
+
+    def conditional_headers(self):
+        """
+        Headers to revalidate this entry with, empty if the server gave nothing to revalidate on.
+        """
+        headers = {}
+        if self.headers.get('ETag'):
+            headers['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+    def to_response(self):
+        """
+        Build a requests.Response out of this entry, so callers can't tell it from a fetched one.
+        """
+        response = r.models.Response()
+        response.url = self.url
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response.encoding = r.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+        response._content = self.body
+        response._content_consumed = True
+        response.from_cache = True
+        return response
+
+
+class ResponseCache(object):
+    """
+    Caches successful responses keyed by url and (sorted) params.
+
+    Entries are fresh for the TTL of their resource type (see `get_ttl`), stale ones are
+    revalidated with If-None-Match / If-Modified-Since when the server sent an ETag or
+    Last-Modified. Bodies are stored zlib compressed, and the least recently used entries
+    are evicted once they take more than `max_size` bytes.
+
+    The cache is best effort: when its database can't be read or written (e.g. locked
+    by other processes for longer than `timeout`), lookups miss and stores are skipped.
+    """
+    # Resource type -> seconds. The type is the resource path without ids,
+    # e.g. bug/123/comment -> bug/comment. Types not listed fall back on their first part.
+    TTLS = {
+        'bug': 60 * 60,
+        'bug/comment': 60 * 60,
+        'bug/attachment': 7 * 24 * 60 * 60,
+        'product': 24 * 60 * 60,
+        'component': 24 * 60 * 60,
+        'classification': 24 * 60 * 60,
+        'field': 24 * 60 * 60,
+        'group': 24 * 60 * 60,
+        'flag_type': 24 * 60 * 60,
+        'version': 24 * 60 * 60,
+    }
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, path, max_size=512 * 1024 * 1024, ttls=None, timeout=10):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = dict(self.TTLS, **(ttls or {}))
+        self.timeout = timeout
+
+    def _get_database(self):
+        return get_database(self.path, self.timeout)
+
+    def get_ttl(self, resource):
+        resource_type = '/'.join(part for part in resource.split('/') if part and not part.isdigit())
+        if resource_type in self.ttls:
+            return self.ttls[resource_type]
+        return self.ttls.get(resource_type.split('/')[0], self.DEFAULT_TTL)
+
+    def get_key(self, url, params):
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        return hashlib.sha1(('%s?%s' % (url, query)).encode('utf-8')).hexdigest()
+
+    def lookup(self, resource, url, params):
+        """
+        Return the CacheEntry of given request, fresh or not, None if not cached.
+        """
+        key = self.get_key(url, params)
+        try:
+            db, lock = self._get_database()
+            with lock, db:
+                row = db.execute(
+                    'SELECT url, status_code, headers, body, stored_at FROM responses WHERE key = ?', (key, )
+                ).fetchone()
+                if row is None:
+                    return
+                db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error as e:
+            logger.warning("Response cache lookup failed, treated as a miss: %s", e)
+            return
+        url, status_code, headers, body, stored_at = row
+        return CacheEntry(key, url, status_code, json.loads(headers), zlib.decompress(body),
+                          stored_at, self.get_ttl(resource))
+
+    def store(self, resource, url, params, response):
+        """
+        Cache given successful response of given request.
+        """
+        key = self.get_key(url, params)
+        body = zlib.compress(response.content)
+        now = time.time()
+        try:
+            db, lock = self._get_database()
+            with lock, db:
+                db.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, response.url, response.status_code, json.dumps(dict(response.headers)),
+                     sqlite3.Binary(body), len(body), now, now))
+                self._evict(db)
+        except sqlite3.Error as e:
+            logger.warning("Response cache store failed, not cached: %s", e)
+
+    def revalidated(self, entry):
+        """
+        Mark given entry as fresh again, after the server answered 304 Not Modified.
+        """
+        entry.stored_at = time.time()
+        try:
+            db, lock = self._get_database()
+            with lock, db:
+                db.execute('UPDATE responses SET stored_at = ? WHERE key = ?', (entry.stored_at, entry.key))
+        except sqlite3.Error as e:
+            logger.warning("Response cache update failed: %s", e)
+
+    def _evict(self, db):
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Go down to 90% so that eviction doesn't run on every store
+        to_free = total - self.max_size * 0.9
+        for key, size in db.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+            db.execute('DELETE FROM responses WHERE key = ?', (key, ))
+            to_free -= size
+            if to_free <= 0:
+                break
+
+    def clear(self):
+        db, lock = self._get_database()
+        with lock, db:
+            db.execute('DELETE FROM responses')
@@ -0,0 +1,130 @@
+"""
+Helpers to consume large Bugzilla JSON responses incrementally,
+without holding the whole body (or a decoded copy of it) in memory,
+and to decode whole ones with the fastest JSON library available.
+"""
+import base64
+import codecs
+import json
+import re
+
+import six
+
+# orjson and ujson are optional, a lot faster than the stdlib decoder on big pages of bugs
+try:
+    import orjson
+    JSON_BACKEND, _loads = 'orjson', orjson.loads
+except ImportError:
+    try:
+        import ujson
+        JSON_BACKEND, _loads = 'ujson', ujson.loads
+    except ImportError:
+        JSON_BACKEND, _loads = 'json', json.loads
+
+
+def loads(data):
+    """
+    Decode given JSON document (bytes or text) with `JSON_BACKEND`.
+    """
+    if JSON_BACKEND == 'json' and isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return _loads(data)
+
+
+def iter_file_chunks(fileobj, size=64 * 1024):
+    """
+    Yield the content of given file (opened in binary mode) `size` bytes at a time.
+    """
+    while True:
+        chunk = fileobj.read(size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def iter_base64_json_field(chunks, field):
+    """
+    Given an iterable of byte chunks of a JSON document, yield the decoded bytes
+    of the first base64 string value of key `field`, as they arrive.
+
+    Meant for attachment `data`, which can be many MBs: only one chunk of it
+    is held in memory at a time, and the rest of the document is ignored.
+    """
+    start = re.compile(br'"' + re.escape(field.encode('ascii')) + br'"\s*:\s*"')
+    buf = b''
+    found = False
+    for chunk in chunks:
+        buf += chunk
+        if not found:
+            match = start.search(buf)
+            if not match:
+                # Keep enough of the tail for a key split across chunks
+                buf = buf[-(len(field) + 64):]
+                continue
+            found = True
+            buf = buf[match.end():]
+        end = buf.find(b'"')
+        if end != -1:
+            buf = buf[:end]
+        # JSON encoders may escape "/" as "\/", base64 has no backslashes otherwise
+        buf = buf.replace(b'\\', b'')
+        # Decode whole 4 character groups only, the rest waits for the next chunk
+        usable = len(buf) - len(buf) % 4
+        if usable:
+            yield base64.b64decode(buf[:usable])
+        buf = buf[usable:]
+        if end != -1:
+            break
+    if not found:
+        raise ValueError("No %s field in JSON document" % field)
+    if buf:
+        yield base64.b64decode(buf)
+
+
+# Whitespace and commas between the items of an array
+_ITEM_SEPARATOR = re.compile(r'[\s,]*')
+
+
+def iter_json_array(chunks, field):
+    """
+    Given an iterable of byte chunks of a JSON document, yield the items of the first
+    array value of key `field` one by one, as soon as each is complete.
+
+    Meant for the `bugs` of bugs API responses and dumps: only the item being decoded
+    (plus one chunk) is held as text, never the whole document or all of its items.
+    Items must be objects or arrays, a number split across chunks would be cut short.
+    """
+    start = re.compile(u'"' + re.escape(field) + u'"\\s*:\\s*\\[')
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    buf = u''
+    pos = None
+    for chunk in chunks:
+        buf += text_decoder.decode(chunk) if isinstance(chunk, bytes) else six.text_type(chunk)
+        if pos is None:
+            match = start.search(buf)
+            if not match:
+                # Keep enough of the tail for a key split across chunks
+                buf = buf[-(len(field) + 64):]
+                continue
+            pos = match.end()
+        while True:
+            pos = _ITEM_SEPARATOR.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if buf[pos] == u']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Incomplete item, the rest of it is in the next chunks
+                break
+            yield item
+            pos = end
+        buf = buf[pos:]
+        pos = 0
+    if pos is None:
+        raise ValueError("No %s field in JSON document" % field)
+    # The array never got closed, let the decoder say what is wrong with the leftover
+    decoder.raw_decode(buf)
+    raise ValueError("Unterminated %s array in JSON document" % field)
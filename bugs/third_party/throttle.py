@@ -0,0 +1,99 @@
+"""
+Politeness limits for requests made to third party hosts, and how long to back off
+when a host pushes back anyway.
+"""
+import random
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+from six.moves.urllib.parse import urlparse
+
+
+class HostThrottle(object):
+    """
+    Token bucket limiting requests to one host to `rate` per second on average, with
+    bursts of up to `burst` requests, however many threads are making them.
+
+    When the host asks for a break (429/503 with Retry-After), `pause` holds back
+    every thread, not just the one that got told off.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated_at = time.time()
+        self._paused_until = 0
+
+    def wait(self):
+        """
+        Block until a request may be made, and take its token.
+        """
+        with self._lock:
+            now = time.time()
+            if self._paused_until > now:
+                time.sleep(self._paused_until - now)
+                now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens < 1:
+                # Sleeping with the lock held queues the other threads up behind this one
+                time.sleep((1 - self._tokens) / self.rate)
+                self._tokens = 1
+                self._updated_at = time.time()
+            self._tokens -= 1
+
+    def pause(self, seconds):
+        """
+        Make no request for the next `seconds`, on any thread.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+            self._tokens = 0
+
+
+_host_throttles = {}
+_host_throttles_lock = threading.Lock()
+
+
+def get_host_throttle(url, rate, burst=1):
+    """
+    Return the process-wide HostThrottle of the host of given url,
+    so all clients talking to the same host share its limits.
+    """
+    host = urlparse(url).netloc
+    with _host_throttles_lock:
+        if host not in _host_throttles:
+            _host_throttles[host] = HostThrottle(rate, burst)
+        return _host_throttles[host]
+
+
+def get_retry_after(response):
+    """
+    Return the seconds to wait asked for by the Retry-After header of given response
+    (either delay-seconds or an HTTP date), None if there is none or it can't be parsed.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return
+    return max(0, mktime_tz(date) - time.time())
+
+
+def get_backoff_delay(attempt, base, cap, retry_after=None):
+    """
+    Seconds to wait before retry number `attempt` (starting at 0): exponential backoff
+    with full jitter, so that clients failing together don't retry together,
+    but never less than the host's `retry_after`.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
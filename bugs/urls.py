@@ -0,0 +1,13 @@
+from django.conf.urls import include, url
+from rest_framework.routers import DefaultRouter
+
+from bugs import views
+
+router = DefaultRouter()
+router.register(r'bugs', views.BugViewSet, base_name='bug')
+
+urlpatterns = [
+    url(r'^bug-counts/$', views.BugCountView.as_view(), name='bug-counts'),
+    url(r'^bug-counts/history/$', views.BugCountHistoryView.as_view(), name='bug-counts-history'),
+    url(r'^', include(router.urls)),
+]
@@ -0,0 +1,7 @@
+def chunked(values, size):
+    """
+    Split given iterable of values into sorted lists of at most `size` values.
+    """
+    values = sorted(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
@@ -1,6 +1,170 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.shortcuts import render
+import calendar
 
-# Create your views here.
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.utils.dateparse import parse_date
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import viewsets
+from rest_framework.decorators import list_route
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from bugs import models, rollups
+from bugs.filters import BugFilter
+from bugs.metrics import metrics
+from bugs.pagination import BugCursorPagination
+from bugs.serializers import BugSerializer
+
+
+def prometheus_metrics(request):
+    """
+    Metrics of this process, plus the latest ImportRun of each import task
+    (which ran in Celery workers), in Prometheus text exposition format.
+    """
+    lines = [metrics.to_prometheus().rstrip('\n')]
+    latest_runs = {}
+    for run in models.ImportRun.objects.order_by('name', '-started_at').distinct('name'):
+        latest_runs[run.name] = run
+    gauges = (
+        ('bugzilla_last_import_bugs_saved', lambda run: run.bugs_saved),
+        ('bugzilla_last_import_seconds', lambda run: run.seconds),
+        ('bugzilla_last_import_bugs_per_second', lambda run: run.bugs_per_sec),
+        ('bugzilla_last_import_http_requests', lambda run: run.http_requests),
+        ('bugzilla_last_import_http_bytes', lambda run: run.http_bytes),
+        ('bugzilla_last_import_db_queries', lambda run: run.db_queries),
+        ('bugzilla_last_import_finished_timestamp_seconds',
+         lambda run: calendar.timegm(run.finished_at.utctimetuple())),
+    )
+    for name, get_value in gauges:
+        lines.append('# TYPE %s gauge' % name)
+        for task, run in sorted(latest_runs.items()):
+            lines.append('%s{task="%s"} %r' % (name, task, float(get_value(run))))
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class BugViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Bugs, by `bz_id`. List filters: product, component, status, severity, priority
+    (names, comma separated for several), is_open, last_change_time_after/_before.
+    `?fields=bz_id,summary,status` only returns the given fields.
+
+    `search/?q=<words>` ranks bugs by full-text match of their summary, whiteboard,
+    resolution and comments, `search/?contains=<fragment>` finds substrings (e.g. of a
+    stack trace) in them. The best `limit` (default 50) bugs are returned, the list
+    filters apply too.
+    """
+    SEARCH_LIMIT = 50
+    MAX_SEARCH_LIMIT = 500
+
+    serializer_class = BugSerializer
+    lookup_field = 'bz_id'
+    pagination_class = BugCursorPagination
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
+    filter_class = BugFilter
+    ordering_fields = ('bz_id', 'last_change_time')
+    # Without `?ordering=`, which BugCursorPagination needs from OrderingFilter
+    ordering = 'bz_id'
+
+    def get_queryset(self):
+        """
+        Join the FKs and prefetch the M2Ms that get serialized, and only those:
+        a page takes one query, plus one per M2M field shown, whatever its size.
+        """
+        requested = BugSerializer.get_requested_fields(self.request)
+        select_related, prefetch_related = [], []
+        for field in models.Bug._meta.get_fields():
+            if not field.is_relation or field.auto_created:
+                continue
+            if requested is not None and field.name not in requested:
+                continue
+            if field.many_to_many:
+                prefetch_related.append(field.name)
+            else:
+                select_related.append(field.name)
+        return models.Bug.objects.select_related(*select_related).prefetch_related(*prefetch_related)
+
+    @list_route()
+    def search(self, request):
+        text = request.query_params.get('q', '').strip()
+        fragment = request.query_params.get('contains', '').strip()
+        if not text and not fragment:
+            raise ValidationError({'q': 'Give words to search (q) or a fragment to find (contains).'})
+        try:
+            limit = min(int(request.query_params.get('limit', self.SEARCH_LIMIT)), self.MAX_SEARCH_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': 'Expected a number.'})
+        # Filters only, the ordering is the search ranking
+        queryset = DjangoFilterBackend().filter_queryset(request, self.get_queryset(), self)
+        queryset = queryset.search(text) if text else queryset.contains(fragment)
+        if text and fragment:
+            queryset = queryset.filter(pk__in=models.Bug.objects.contains(fragment).values('pk'))
+        serializer = self.get_serializer(queryset[:limit], many=True)
+        return Response({'results': serializer.data})
+
+
+class BugCountView(APIView):
+    """
+    Bug counts from the BugCount rollup, summed by the `group_by` dimensions (comma separated
+    among product, component, severity, status, is_open; default product,status).
+    Filters: product, component, severity, status (comma separated names), is_open.
+    """
+    model = models.BugCount
+    DIMENSIONS = rollups.DIMENSIONS
+    DEFAULT_GROUP_BY = 'product,status'
+
+    def get_group_by(self):
+        group_by = [name.strip() for name in
+                    self.request.query_params.get('group_by', self.DEFAULT_GROUP_BY).split(',') if name.strip()]
+        unknown = set(group_by).difference(self.DIMENSIONS)
+        if unknown:
+            raise ValidationError({'group_by': 'Unknown dimensions: %s' % ', '.join(sorted(unknown))})
+        return group_by
+
+    def filter_queryset(self, queryset):
+        params = self.request.query_params
+        for name, lookup in self.DIMENSIONS.items():
+            if name == 'is_open':
+                if 'is_open' in params:
+                    queryset = queryset.filter(is_open=params['is_open'].lower() in ('1', 'true'))
+            elif params.get(name):
+                queryset = queryset.filter(**{lookup + '__in': params[name].split(',')})
+        return queryset
+
+    def get(self, request):
+        group_by = self.get_group_by()
+        values = [self.DIMENSIONS[name] for name in group_by]
+        rows = (self.filter_queryset(self.model.objects.all())
+                .values(*values).annotate(total=Sum('count')).order_by(*values))
+        names = dict(zip(values, group_by), total='count')
+        return Response({'results': [
+            {names.get(key, key): value for key, value in row.items()} for row in rows if row['total']
+        ]})
+
+
+class BugCountHistoryView(BugCountView):
+    """
+    Daily bug counts from the BugCountSnapshot rows, same as BugCountView plus
+    the `date` of each count, between `date_from` and `date_to` (inclusive, YYYY-MM-DD).
+    """
+    model = models.BugCountSnapshot
+    DIMENSIONS = dict(BugCountView.DIMENSIONS, date='date')
+
+    def get_group_by(self):
+        group_by = super(BugCountHistoryView, self).get_group_by()
+        return ['date'] + [name for name in group_by if name != 'date']
+
+    def filter_queryset(self, queryset):
+        queryset = super(BugCountHistoryView, self).filter_queryset(queryset)
+        for param, lookup in (('date_from', 'date__gte'), ('date_to', 'date__lte')):
+            value = self.request.query_params.get(param)
+            if value:
+                date = parse_date(value)
+                if date is None:
+                    raise ValidationError({param: 'Expected a YYYY-MM-DD date.'})
+                queryset = queryset.filter(**{lookup: date})
+        return queryset
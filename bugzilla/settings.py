@@ -39,6 +39,8 @@ PROJECT_APPS = [
 ]
 THIRD_PARTY_APPS = [
     'django_extensions',
+    'rest_framework',
+    'django_filters',
 ]
 DJANGO_APPS = [
     'django.contrib.admin',
@@ -47,6 +49,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + PROJECT_APPS
 
@@ -133,7 +136,62 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded/downloaded files, e.g. bug attachments
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_URL = '/media/'
+
 BZ_API_KEY = config.get('api_auth', 'bugzilla_api_key')
 BUGZILLA_REST_BASE = config.get('third_party_apis', 'bugzilla_rest_base')
+# Number of bug search pages fetched in parallel
+BUGZILLA_FETCH_CONCURRENCY = 4
+# Requests per second to the Bugzilla host on average, over all threads of a process,
+# with bursts of up to BUGZILLA_REQUEST_BURST requests
+BUGZILLA_REQUESTS_PER_SECOND = 5
+BUGZILLA_REQUEST_BURST = 5
+# (connect, read) timeout in seconds of each request
+BUGZILLA_REQUEST_TIMEOUT = (10, 60)
+# Retries of failed requests, waiting up to BUGZILLA_BACKOFF_BASE * 2 ** retry seconds
+# (at most BUGZILLA_BACKOFF_MAX, or what Retry-After asks for) before each
+BUGZILLA_MAX_RETRIES = 5
+BUGZILLA_BACKOFF_BASE = 1
+BUGZILLA_BACKOFF_MAX = 120
+# SQLite file caching raw Bugzilla responses (see bugs.third_party.cache), None to not cache
+BUGZILLA_HTTP_CACHE_PATH = None
+BUGZILLA_HTTP_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# Number of bug ids imported by each task of a parallel import (`bugs.tasks.import_bugzilla_bugs`)
+BUGZILLA_IMPORT_CHUNK_SIZE = 2000
+# Count the DB queries of each import stage (see bugs.metrics), at the cost of logging them
+# in memory while the stage runs. Off, the `*_queries` metrics and ImportRun.db_queries stay 0
+BUGZILLA_METRICS_COUNT_QUERIES = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'bugs': {
+            'handlers': ['console'],
+            'level': os.environ.get('BUGS_LOG_LEVEL', 'INFO'),
+            # Celery workers log the root logger already
+            'propagate': False,
+        },
+    },
+}
 
 AUTH_USER_MODEL = 'bugs.User'
+
+REST_FRAMEWORK = {
+    # Bugs show user emails, keep them to people with an account
+    'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated', ),
+    'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend', ),
+}
@@ -13,9 +13,13 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
-from django.conf.urls import url
+from django.conf.urls import include, url
 from django.contrib import admin
 
+from bugs import views as bugs_views
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^api/', include('bugs.urls')),
+    url(r'^metrics$', bugs_views.prometheus_metrics, name='metrics'),
 ]